@@ -1,15 +1,59 @@
+import asyncio
+import fcntl
 import os
 import aiosqlite
+import numpy as np
+import orjson
 
-from typing import Any
+from contextlib import asynccontextmanager
+from itertools import cycle
+from typing import Any, Iterable, List
 
-from app.variables import DB_PATH, EXTENSIONS, SCHEMAS, PRAGMAS
+from app.variables import DB_PATH, EXTENSIONS, SCHEMAS, PRAGMAS, MIGRATIONS, DB_READERS
 
 
-async def init_db(init_if_missing: bool = False) -> Any:
-    db_exists = os.path.exists(DB_PATH)
+READ_PREFIXES = ("SELECT", "WITH")
 
-    db = await aiosqlite.connect(DB_PATH)
+
+class Database:
+    """
+    One dedicated writer connection plus N read-only WAL connections.
+    Each aiosqlite connection runs on its own thread, so reads no longer queue behind writes.
+    Exposes the subset of the aiosqlite connection API the services use and routes by statement.
+    """
+
+    def __init__(self, writer: Any, readers: List[Any]):
+        self.writer = writer
+        self.readers = readers
+        self._next_reader = cycle(readers or [writer])
+
+    def reader(self) -> Any:
+        return next(self._next_reader)
+
+    def execute(self, sql: str, parameters: Iterable[Any] | None = None) -> Any:
+        conn = self.reader() if sql.lstrip().upper().startswith(READ_PREFIXES) else self.writer
+        return conn.execute(sql, parameters)
+
+    def executemany(self, sql: str, parameters: Iterable[Iterable[Any]]) -> Any:
+        return self.writer.executemany(sql, parameters)
+
+    def executescript(self, sql: str) -> Any:
+        return self.writer.executescript(sql)
+
+    async def commit(self) -> None:
+        await self.writer.commit()
+
+    async def close(self) -> None:
+        for conn in self.readers:
+            await conn.close()
+        await self.writer.close()
+
+
+async def connect(readonly: bool = False) -> Any:
+    if readonly:
+        db = await aiosqlite.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+    else:
+        db = await aiosqlite.connect(DB_PATH)
 
     db.row_factory = aiosqlite.Row
 
@@ -21,18 +65,104 @@ async def init_db(init_if_missing: bool = False) -> Any:
         except Exception as e:
             print(f"[db] Failed loading {ext}: {e}")
 
-    if init_if_missing and not db_exists:
-        for sql in SCHEMAS:
-            schema = sql.read_text(encoding="utf-8")
-            await db.executescript(schema)
-            await db.commit()
-            print("[db] Schema applied.")
+    return db
+
+
+async def apply_pragmas(db: Any, readonly: bool = False) -> None:
+    pragmas = PRAGMAS + ["PRAGMA query_only=ON;"] if readonly else PRAGMAS
 
-    for p in PRAGMAS:
+    for p in pragmas:
         try:
             await db.execute(p)
         except Exception as e:
             print(f"[db] Failed PRAGMA {p}: {e}")
 
-    await db.commit()
-    return db
+
+@asynccontextmanager
+async def file_lock(path: str):  # type: ignore
+    """
+    Cross-process lock, every worker runs startup and only one may create the schema.
+    """
+    with open(path, "a") as f:
+        await asyncio.to_thread(fcntl.flock, f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+async def init_db(init_if_missing: bool = False, readers: int = DB_READERS) -> Database:
+    async with file_lock(f"{DB_PATH}.lock"):
+        db_exists = os.path.exists(DB_PATH)
+
+        db = await connect()
+
+        if init_if_missing and not db_exists:
+            for sql in SCHEMAS:
+                schema = sql.read_text(encoding="utf-8")
+                await db.executescript(schema)
+                await db.commit()
+                print("[db] Schema applied.")
+
+        await migrate(db)
+
+        await apply_pragmas(db)
+
+        await db.commit()
+
+    pool = []
+    for _ in range(readers):
+        reader = await connect(readonly=True)
+        await apply_pragmas(reader, readonly=True)
+        pool.append(reader)
+
+    return Database(db, pool)
+
+
+async def migrate(db: Any) -> None:
+    for table, columns in MIGRATIONS.items():
+        async with db.execute(f"PRAGMA table_info({table});") as cur:
+            existing = {row[1] for row in await cur.fetchall()}
+
+        if not existing:
+            continue
+
+        for column, sql in columns:
+            if column in existing:
+                continue
+            try:
+                await db.execute(sql)
+                print(f"[db] Added column {table}.{column}")
+            except Exception as e:
+                print(f"[db] Failed migration {sql}: {e}")
+
+    await migrate_embeddings(db)
+
+
+async def migrate_embeddings(db: Any) -> None:
+    """
+    Databases created before the in-memory vector index keep embeddings in a vss0 virtual table.
+    Copies them into the plain table and drops the virtual one, together with its shadow tables.
+    """
+    async with db.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'embeddings';") as cur:
+        row = await cur.fetchone()
+    if row is None or "vss0" not in (row[0] or "").lower():
+        return
+
+    try:
+        # vss0 hands vectors out as pointers, the vector extension turns them into JSON
+        async with db.execute("SELECT rowid, vector_to_json(embedding) FROM embeddings;") as cur:
+            rows = [
+                (rid, np.asarray(orjson.loads(vec), dtype=np.float32).tobytes())
+                for rid, vec in await cur.fetchall() if vec
+            ]
+
+        await db.execute("BEGIN;")
+        await db.execute("DROP TABLE embeddings;")
+        await db.execute("CREATE TABLE embeddings (rowid INTEGER PRIMARY KEY, embedding BLOB);")
+        await db.executemany("INSERT INTO embeddings (rowid, embedding) VALUES (?, ?);", rows)
+        await db.commit()
+        print(f"[db] Moved {len(rows)} embeddings out of the vss0 table")
+    except Exception as e:
+        await db.rollback()
+        print(f"[db] Failed migrating the vss0 embeddings table: {e}")
@@ -2,13 +2,38 @@ from fastapi import FastAPI
 
 from app.database import init_db
 from app.redis_db import init_redis
+from app.utils.llm import init_http_clients, close_http_clients
+from app.utils.vector_index import init_vector_index, close_vector_index
+from app.services.interactions import interaction_writer
+from app.services.login import credential_writer, seen_usernames
+from app.utils.sync import sync_listener
+from app.utils.templates import template_registry
+from app.utils.metrics import metrics
 
 
 async def startup(app: FastAPI) -> None:
     app.state.db = await init_db(True)
     app.state.redis = await init_redis()
+    init_http_clients()
+    await init_vector_index(app.state.db)
+    interaction_writer.start(app.state.db)
+    credential_writer.start(app.state.db)
+    try:
+        await seen_usernames.load(app.state.db, app.state.redis)
+    except Exception as e:
+        print(f"[login] Could not seed seen usernames: {e}")
+    await sync_listener.start(app.state.redis, app.state.db)
+    template_registry.start()
+    await metrics.start(app.state.redis)
 
 
 async def shutdown(app: FastAPI) -> None:
+    await metrics.stop()
+    await template_registry.stop()
+    await sync_listener.stop()
+    await interaction_writer.stop()
+    await credential_writer.stop()
+    await close_vector_index()
     await app.state.db.close()
     await app.state.redis.close()
+    await close_http_clients()
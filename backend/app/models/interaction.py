@@ -1,16 +1,28 @@
 
-from pydantic import BaseModel
 from typing import Any, Optional
 import orjson
 from app.models.requests import RequestValidator
 from app.models.llm import DEFAULT_HEADERS
 
 
-class InteractionCreate(BaseModel):
-    request: RequestValidator
-    response_body: Optional[Any] = None
-    response_status: int
-    response_headers: Optional[Any] = DEFAULT_HEADERS
+class InteractionCreate:
+    """
+    What is logged for one request/response pair. Built on every hit, so no model validation.
+    """
+
+    __slots__ = ("request", "response_body", "response_status", "response_headers")
+
+    def __init__(
+        self,
+        request: RequestValidator,
+        response_status: int,
+        response_body: Optional[Any] = None,
+        response_headers: Optional[Any] = DEFAULT_HEADERS,
+    ):
+        self.request = request
+        self.response_body = response_body
+        self.response_status = response_status
+        self.response_headers = response_headers
 
     @staticmethod
     def normalize_value(value: Any) -> Any:
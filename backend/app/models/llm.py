@@ -1,21 +1,74 @@
 import orjson
 import uuid
 
-from datetime import datetime
-from typing import Any, Dict
+from typing import Any, Dict, List, Tuple
 from pydantic import BaseModel, model_validator
 
+from app.utils.metrics import metrics
+
+# static part only, ids are generated per response and Date is added by the server
 DEFAULT_HEADERS = {
     "Server": "nginx/1.22.1",
-    "X-Request-ID": str(uuid.uuid4()),
-    "X-Trace-ID": str(uuid.uuid4()),
     "X-Response-Time": "auto",
-    "Date": datetime.utcnow().strftime("%a, %d %b %Y %H:%M:%S GMT"),  # type: ignore
     "Cache-Control": "no-cache",
     "Vary": "Accept-Encoding",
 }
 
 
+def default_headers() -> Dict[str, str]:
+    return {
+        **DEFAULT_HEADERS,
+        "X-Request-ID": str(uuid.uuid4()),
+        "X-Trace-ID": str(uuid.uuid4()),
+    }
+
+
+def busy_response() -> Dict[str, Any]:
+    """
+    Served instead of a generation when the GPU is saturated, never stored as a resource.
+    """
+    return {
+        "body": "<html>\r\n<head><title>503 Service Temporarily Unavailable</title></head>\r\n<body>\r\n"
+                "<center><h1>503 Service Temporarily Unavailable</h1></center>\r\n<hr><center>nginx/1.22.1</center>\r\n"
+                "</body>\r\n</html>\r\n",
+        "status_code": 503,
+        "headers": {**default_headers(), "Retry-After": "30"},
+    }
+
+
+FORBIDDEN_HEADERS = {"content-length", "transfer-encoding", "date", "content-type"}
+
+
+def strip_fences(text: str) -> str:
+    """
+    Drops a ``` fence line at the start and a ``` at the end, the way models wrap code.
+    """
+    text = text.strip()
+    if text.startswith("```"):
+        nl = text.find("\n")
+        if nl != -1:
+            text = text[nl + 1:].lstrip()
+    if text.endswith("```"):
+        text = text[:-3].rstrip()
+    return text.strip()
+
+
+def clean_llm_headers(headers: Dict[str, Any]) -> Dict[str, Any]:
+    clean = {}
+    for k, v in headers.items():
+        if isinstance(v, str):
+            if k.lower() in FORBIDDEN_HEADERS:
+                continue
+            clean[k] = v.strip()
+        else:
+            clean[k] = v
+    return clean
+
+
+def is_html(text: str) -> bool:
+    return "<html" in text.lower()
+
+
 class LLMResponse(BaseModel):
     body: Dict[str, Any] | str = {}
     status_code: int = 200
@@ -31,55 +84,286 @@ class LLMResponse(BaseModel):
         if not isinstance(raw, str):
             raise ValueError(f"LLMResponse expects dict or str, got: {type(raw)}")
 
-        txt = raw.strip()
-
-        if txt.startswith("```"):
-            nl = txt.find("\n")
-            if nl != -1:
-                txt = txt[nl + 1:].lstrip()
-        if txt.endswith("```"):
-            txt = txt[:-3].rstrip()
-
-        txt = txt.strip()
+        txt = strip_fences(raw)
 
         try:
             parsed = orjson.loads(txt)
         except Exception:
+            metrics.inc("honeypot_llm_parse_failures_total", reason="not_json")
             return {
                 "body": txt.replace("\r", "").replace("\n", ""),
                 "status_code": 200,
                 "headers": {}
             }
 
+        if not isinstance(parsed, dict):
+            metrics.inc("honeypot_llm_parse_failures_total", reason="not_object")
+            return {"body": txt.replace("\r", "").replace("\n", ""), "status_code": 200, "headers": {}}
+
         body_val = parsed.get("body")
 
         if isinstance(body_val, str):
-            inner = body_val.strip()
+            parsed["body"] = strip_fences(body_val).replace("\r", "").replace("\n", "")
 
-            if inner.startswith("```"):
-                nl = inner.find("\n")
-                if nl != -1:
-                    inner = inner[nl + 1:].lstrip()
-            if inner.endswith("```"):
-                inner = inner[:-3].rstrip()
+        headers_val = parsed.get("headers")
+        if not isinstance(headers_val, dict):
+            metrics.inc("honeypot_llm_parse_failures_total", reason="headers")
+            headers_val = {}
+        parsed["headers"] = clean_llm_headers(headers_val)
 
-            inner = inner.strip()
-            inner = inner.replace("\r", "").replace("\n", "")
+        return parsed
 
-            parsed["body"] = inner
 
-        headers_val = parsed.get("headers")
-        forbidden = {"content-length", "transfer-encoding", "date"}
-
-        clean_headers = {}
-        for k, v in headers_val.items():
-            if isinstance(v, str):
-                key_lower = k.lower()
-                if key_lower in forbidden or key_lower == "content-type":
-                    continue
-                clean_headers[k] = v.strip()
-            else:
-                clean_headers[k] = v
-        parsed["headers"] = clean_headers
+class LLMStreamParser:
+    """
+    Incremental reader for the {"status_code", "headers", "body"} envelope while the model is still writing it.
 
-        return parsed
+    feed() returns events as soon as they are known:
+      ("head", status_code, headers, media_type) when the body starts and status/headers are complete,
+      ("chunk", bytes) for every body fragment after that.
+    The body goes through the same normalisation as LLMResponse, so the streamed bytes are the ones
+    stored: string bodies lose their ``` fences and surrounding whitespace, anything that could still
+    be a closing fence is held back, and a string body is only streamed early once it is known to be
+    HTML. JSON bodies are sent re-serialised once they are complete.
+    If the envelope arrives in another order (or is not JSON) nothing is emitted and the caller
+    falls back to LLMResponse on the full text.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.started = False
+        self.done = False
+        self.fallback = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._unicode_left = 0
+        self._expect_key = False
+        self._key_start: int | None = None
+        self._key: str | None = None
+        self._raw_start: int | None = None
+        self._value_pending = False
+        self._values: Dict[str, Any] = {}
+        self._body_kind: str | None = None
+        self._body_from = 0
+        self._lead = ""
+        self._lead_done = False
+        self._sniff = ""
+        self._tail = ""
+        self._lstripped = False
+
+    def feed(self, delta: str) -> List[Tuple[Any, ...]]:
+        self.text += delta
+        events: List[Tuple[Any, ...]] = []
+        if self.done or self.fallback:
+            return events
+
+        text = self.text
+        while self._pos < len(text) and not self.done and not self.fallback:
+            self._step(text[self._pos], events)
+            self._pos += 1
+
+        if self._body_kind and not self.done:
+            self._flush_body(events, self._pos)
+
+        return events
+
+    def _step(self, ch: str, events: List[Tuple[Any, ...]]) -> None:
+        pos = self._pos
+
+        if self._in_string:
+            if self._unicode_left:
+                self._unicode_left -= 1
+            elif self._escape:
+                self._escape = False
+                if ch == "u":
+                    self._unicode_left = 4
+            elif ch == "\\":
+                self._escape = True
+            elif ch == '"':
+                self._in_string = False
+                if self._key_start is not None:
+                    self._key = orjson.loads(self.text[self._key_start:pos + 1])
+                    self._key_start = None
+                elif self._body_kind == "string" and self._depth == 1:
+                    self._flush_body(events, pos)
+                    self._end_body(events)
+            return
+
+        if self._depth == 0:
+            # skip ``` fences and anything else before the envelope
+            if ch == "{":
+                self._depth = 1
+                self._expect_key = True
+            return
+
+        if ch.isspace():
+            return
+
+        if self._depth == 1:
+            if self._expect_key:
+                if ch == '"':
+                    self._in_string = True
+                    self._key_start = pos
+                    self._expect_key = False
+                elif ch == "}":
+                    self.done = True
+                return
+
+            if ch == ":":
+                self._raw_start = pos + 1
+                self._value_pending = True
+                return
+
+            if self._value_pending and ch not in ",}":
+                self._value_pending = False
+                if self._key == "body":
+                    self._start_body(ch, pos, events)
+                    if self.fallback:
+                        return
+
+            if ch in ",}":
+                self._end_value(pos)
+                if ch == "}":
+                    self.done = True
+                else:
+                    self._expect_key = True
+                return
+
+        if ch == '"':
+            self._in_string = True
+        elif ch in "{[":
+            self._depth += 1
+        elif ch in "}]":
+            self._depth -= 1
+            if self._depth == 1 and self._body_kind == "json":
+                self._end_json(events, pos + 1)
+
+    def _start_body(self, ch: str, pos: int, events: List[Tuple[Any, ...]]) -> None:
+        if "status_code" not in self._values or "headers" not in self._values:
+            self.fallback = True
+            return
+
+        if ch == '"':
+            self._body_kind = "string"
+            self._body_from = pos + 1
+        elif ch in "{[":
+            self._body_kind = "json"
+            self._body_from = pos
+            self._head(events, "application/json")
+            if self.fallback:
+                return
+        else:
+            self.fallback = True
+
+    def _head(self, events: List[Tuple[Any, ...]], media_type: str) -> None:
+        try:
+            status = int(orjson.loads(self._values["status_code"]))
+            headers = orjson.loads(self._values["headers"])
+        except Exception:
+            self.fallback = True
+            return
+        if not isinstance(headers, dict):
+            self.fallback = True
+            return
+
+        self.started = True
+        events.append(("head", status, clean_llm_headers(headers), media_type))
+        if self._sniff:
+            events.append(("chunk", self._sniff.encode("utf-8")))
+            self._sniff = ""
+
+    def _end_value(self, pos: int) -> None:
+        if self._key is not None and self._key != "body" and self._raw_start is not None:
+            self._values[self._key] = self.text[self._raw_start:pos].strip()
+        self._key = None
+        self._raw_start = None
+
+    def _flush_body(self, events: List[Tuple[Any, ...]], end: int) -> None:
+        if self._body_kind != "string":
+            # JSON bodies are sent whole by _end_json
+            return
+
+        # string body: only cut where no escape sequence is pending
+        if self._escape or self._unicode_left or end <= self._body_from:
+            return
+
+        raw = self.text[self._body_from:end]
+        try:
+            piece = orjson.loads(f'"{raw}"')
+        except Exception:
+            # split surrogate pair, wait for the rest
+            return
+        self._body_from = end
+
+        if not self._lead_done:
+            # an opening fence is only known once its line has ended
+            self._lead += piece
+            lead = self._lead.lstrip()
+            if lead.startswith("```"):
+                nl = lead.find("\n")
+                if nl == -1:
+                    return
+                lead = lead[nl + 1:]
+            elif "```".startswith(lead):
+                return
+            self._lead_done = True
+            piece = lead
+
+        self._emit(events, piece)
+
+    def _emit(self, events: List[Tuple[Any, ...]], piece: str) -> None:
+        if not self._lstripped:
+            piece = piece.lstrip()
+            self._lstripped = bool(piece)
+
+        # trailing whitespace and backticks may turn out to be the end of the body or a closing fence
+        text = self._tail + piece
+        cut = len(text)
+        while cut and (text[cut - 1].isspace() or text[cut - 1] == "`"):
+            cut -= 1
+        piece, self._tail = text[:cut], text[cut:]
+        self._send(events, piece)
+
+    def _send(self, events: List[Tuple[Any, ...]], piece: str) -> None:
+        piece = piece.replace("\r", "").replace("\n", "")
+        if self.started:
+            if piece:
+                events.append(("chunk", piece.encode("utf-8")))
+            return
+
+        # held until the body is known to be HTML, which is what the stored copy will be served as
+        checked = max(0, len(self._sniff) - 4)
+        self._sniff += piece
+        if is_html(self._sniff[checked:]):
+            self._head(events, "text/html")
+
+    def _end_body(self, events: List[Tuple[Any, ...]]) -> None:
+        if not self._lead_done:
+            # no newline after an opening fence, LLMResponse keeps it as text too
+            self._lead_done = True
+            self._emit(events, self._lead)
+
+        tail = self._tail.rstrip()
+        if tail.endswith("```"):
+            tail = tail[:-3].rstrip()
+        self._tail = ""
+        self._send(events, tail)
+
+        if not self.started and not self.fallback:
+            self._head(events, "text/html" if is_html(self._sniff) else "text/plain")
+        self._body_kind = None
+        self.done = True
+
+    def _end_json(self, events: List[Tuple[Any, ...]], end: int) -> None:
+        raw = self.text[self._body_from:end]
+        try:
+            # byte for byte what render_body makes of the stored body
+            raw = orjson.dumps(orjson.loads(raw)).decode()
+        except Exception:
+            pass
+        if self.started:
+            events.append(("chunk", raw.encode("utf-8")))
+        self._body_kind = None
+        self.done = True
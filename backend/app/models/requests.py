@@ -3,47 +3,73 @@ import hashlib
 
 import re
 import orjson
-from pydantic import BaseModel, Field, field_validator
-from typing import Any
-from fastapi import HTTPException, Response
+from typing import Any, Dict
+from fastapi import HTTPException
 
 
-class RequestValidator(BaseModel):
-    client_ip: str | None
-    full_path: str
-    method: str
-    query_params: Any | None = None
-    body: dict[str, Any] | None = None
-    headers: dict[str, Any] | None
-    requested_at: datetime = Field(default_factory=datetime.utcnow)  # type: ignore
+UUID_V4_RE = re.compile(
+    r'^[0-9a-f]{8}-?[0-9a-f]{4}-4[0-9a-f]{3}-[89ab][0-9a-f]{3}-?[0-9a-f]{12}$',
+    re.I,
+)
+API_VERSION_RE = re.compile(r'^v[1-3]$', re.I)
+
+
+class RequestValidator:
+    """
+    Per-request context. A plain slotted class rather than a pydantic model: it is built
+    for every request, and the derived keys are computed once on first use.
+    """
+
+    __slots__ = (
+        "client_ip", "full_path", "method", "query_params", "body", "headers", "requested_at",
+        "_semantic_key", "_hash", "_canonical",
+    )
+
+    def __init__(
+        self,
+        client_ip: str | None,
+        full_path: str,
+        method: str,
+        query_params: Any | None = None,
+        body: Dict[str, Any] | None = None,
+        headers: Dict[str, Any] | None = None,
+        requested_at: datetime | None = None,
+    ):
+        self.client_ip = client_ip
+        self.full_path = self.validate_uuid_ids(full_path)
+        self.method = method
+        self.query_params = query_params
+        self.body = body
+        self.headers = headers
+        self.requested_at = requested_at or datetime.utcnow()
+        self._semantic_key: str | None = None
+        self._hash: str | None = None
+        self._canonical: Dict[str | None, str] = {}
 
     @property
     def semantic_key(self) -> str:
-        return f"{self.method} {self.full_path} {orjson.dumps(self.query_params)} {orjson.dumps(self.body)}"
+        if self._semantic_key is None:
+            self._semantic_key = f"{self.method} {self.full_path} {orjson.dumps(self.query_params)} {orjson.dumps(self.body)}"
+        return self._semantic_key
 
     @property
     def hash(self) -> str:
-        signature_raw = f"{self.method}:{self.full_path}:{self.query_params}:{self.body}"
-        return hashlib.sha256(signature_raw.encode()).hexdigest()
+        if self._hash is None:
+            signature_raw = f"{self.method}:{self.full_path}:{self.query_params}:{self.body}"
+            self._hash = hashlib.sha256(signature_raw.encode()).hexdigest()
+        return self._hash
 
     def canonicalize(self, method: str | None = None):
-        qp = "&".join(f"{k}={v}" for k, v in sorted(self.query_params.items())) if self.query_params else None
-        return f"{method}:{self.full_path}{"?" + qp if qp else ""}"
-
-    @field_validator("full_path")
-    @classmethod
-    def validate_uuid_ids(cls, v: str) -> str | Response:
-        UUID_V4_RE = re.compile(
-            r'^[0-9a-f]{8}-?[0-9a-f]{4}-4[0-9a-f]{3}-[89ab][0-9a-f]{3}-?[0-9a-f]{12}$',
-            re.I,
-        )
-        API_VERSION_RE = re.compile(r'^v[1-3]$', re.I)
-
-        segments = [s for s in v.split("/") if s]
+        canonical = self._canonical.get(method)
+        if canonical is None:
+            qp = "&".join(f"{k}={v}" for k, v in sorted(self.query_params.items())) if self.query_params else None
+            canonical = self._canonical[method] = f"{method}:{self.full_path}{"?" + qp if qp else ""}"
+        return canonical
 
-        for seg in segments:
-
-            if API_VERSION_RE.fullmatch(seg):
+    @staticmethod
+    def validate_uuid_ids(v: str) -> str:
+        for seg in v.split("/"):
+            if not seg:
                 continue
 
             if seg.isalpha():
@@ -52,6 +78,9 @@ class RequestValidator(BaseModel):
             if not seg.isalnum():
                 continue
 
+            if API_VERSION_RE.fullmatch(seg):
+                continue
+
             if not UUID_V4_RE.fullmatch(seg):
                 raise HTTPException(
                     status_code=404,
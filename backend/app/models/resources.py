@@ -1,9 +1,69 @@
 
+import gzip
+import hashlib
 import numpy as np
 import orjson
+from datetime import datetime, timezone
+from email.utils import format_datetime
 from pydantic import BaseModel
 from typing import Any, Dict, List, Optional, Tuple
 
+from app.variables import GZIP_MIN_SIZE, GZIP_LEVEL, BROTLI_QUALITY
+
+try:
+    import brotli  # type: ignore
+except ImportError:
+    brotli = None
+
+
+def render_body(body: Any) -> Tuple[bytes, str]:
+    """
+    Renders a response body once into bytes and its media type.
+    """
+    if isinstance(body, (dict, list)):
+        return orjson.dumps(body), "application/json"
+
+    if body is None:
+        return b"", "text/plain"
+
+    text = str(body)
+    if "<html" in text.lower():
+        return text.encode("utf-8"), "text/html"
+
+    return text.encode("utf-8"), "text/plain"
+
+
+def compress_body(raw: bytes) -> bytes | None:
+    if len(raw) < GZIP_MIN_SIZE:
+        return None
+    return gzip.compress(raw, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def compress_br(raw: bytes) -> bytes | None:
+    if brotli is None or len(raw) < GZIP_MIN_SIZE:
+        return None
+    return brotli.compress(raw, quality=BROTLI_QUALITY)
+
+
+def content_etag(raw: bytes, media_type: str) -> str:
+    """
+    Strong validator of the identity representation, encoded variants append -gzip / -br.
+    """
+    return '"' + hashlib.sha256(media_type.encode() + b"\0" + raw).hexdigest()[:32] + '"'
+
+
+def http_date(value: Any) -> str | None:
+    """
+    SQLite CURRENT_TIMESTAMP (UTC, 'YYYY-MM-DD HH:MM:SS') -> IMF-fixdate.
+    """
+    if not value:
+        return None
+    try:
+        dt = value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    return format_datetime(dt.replace(tzinfo=timezone.utc, microsecond=0), usegmt=True)
+
 
 class ResourceCreate(BaseModel):
     canonical_key: str | None = None
@@ -12,6 +72,7 @@ class ResourceCreate(BaseModel):
     response_status: int = 200
     response_headers: Optional[Any] = None
     embedding: Optional[List[float]] = None
+    template_version: str | None = None
 
     @staticmethod
     def decode_body(raw: bytes) -> Any:
@@ -50,24 +111,37 @@ class ResourceCreate(BaseModel):
         return str(getattr(self, key)).encode("utf-8")
 
     def get_insert_query(self) -> Tuple[str, Tuple[Any]]:
-        print(self.response_headers)
         sql = """
             INSERT INTO resources (
                 canonical_key,
                 response_body,
                 path,
                 response_status,
-                response_headers
+                response_headers,
+                response_raw,
+                response_gzip,
+                response_br,
+                etag,
+                media_type,
+                template_version
             )
-            VALUES (?, ?, ?, ?, ?)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """
 
+        raw, media_type = render_body(self.response_body)
+
         params = (
             self.canonical_key,
             self.get_blob('response_body'),
             self.path,
             self.response_status,
-            self.get_blob('response_headers')
+            self.get_blob('response_headers'),
+            raw,
+            compress_body(raw),
+            compress_br(raw),
+            content_etag(raw, media_type),
+            media_type,
+            self.template_version
         )
 
         return sql, params  # type: ignore
@@ -83,6 +157,12 @@ class ResourceDB(BaseModel):
     response_body: Optional[Dict[str, Any] | str] = None
     response_status: int = 200
     response_headers: Optional[Any] = None
+    response_raw: bytes = b""
+    response_gzip: bytes | None = None
+    response_br: bytes | None = None
+    media_type: str = "text/plain"
+    etag: str | None = None
+    last_modified: str | None = None
 
     @staticmethod
     def decode_body(raw: bytes | str | None) -> Any:
@@ -110,11 +190,36 @@ class ResourceDB(BaseModel):
         except Exception:
             return str(raw)
 
+    @staticmethod
+    def row_size(row: Dict[str, Any]) -> int:
+        return sum(len(row.get(k) or b"") for k in ("response_body", "response_headers", "response_raw", "response_gzip", "response_br"))
+
     @classmethod
     def from_row(cls, row: Dict[str, Any]) -> "ResourceDB":
-        return cls(
+        body = cls.decode_body(row["response_body"])
+
+        raw = row.get("response_raw")
+        media_type = row.get("media_type")
+        gzipped = row.get("response_gzip")
+        br = row.get("response_br")
+        etag = row.get("etag")
+        if raw is None or media_type is None:
+            # rows written before bodies were pre-rendered
+            raw, media_type = render_body(body)
+            gzipped = compress_body(raw)
+        if etag is None:
+            etag = content_etag(raw, media_type)
+
+        # values come from our own rows, skip validation
+        return cls.model_construct(
             id=row["id"],
-            response_body=cls.decode_body(row["response_body"]),
+            response_body=body,
             response_status=row["response_status"],
             response_headers=cls.decode_body(row["response_headers"]),
+            response_raw=raw,
+            response_gzip=gzipped,
+            response_br=br,
+            media_type=media_type,
+            etag=etag,
+            last_modified=http_date(row.get("updated_at")),
         )
@@ -1,26 +1,206 @@
-from arq.connections import create_pool, RedisSettings
-from fastapi import Response
-from app.variables import REDIS_HOST, REDIS_PORT
+import asyncio
+import time
+import uuid
+import orjson
+
 from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict
+from arq.connections import create_pool, RedisSettings
+from app.variables import REDIS_HOST, REDIS_PORT, SINGLE_FLIGHT_TTL, SINGLE_FLIGHT_RESULT_TTL, SINGLE_FLIGHT_POLL, LLM_TIMEOUT, \
+    LLM_SLOT_POLL, LLM_QUEUE_TIMEOUT
 
 
-async def init_redis():
-    settings = RedisSettings(
+# a sorted set, under a new name so a counter left by an older version cannot clash with it
+LLM_ACTIVE_KEY = "llm:running"
+# a generation can retry on another backend, so only members older than that are left over
+LLM_STALE_AFTER = 2 * LLM_TIMEOUT
+
+
+# Prunes stale generations and adds a new one unless `limit` are already running.
+# KEYS: running set, ARGV: now, stale_before, member, limit (0 for none). Returns 1 when added.
+ACQUIRE_SLOT_LUA = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+local limit = tonumber(ARGV[4])
+if limit > 0 and redis.call('ZCARD', KEYS[1]) >= limit then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[1], ARGV[3])
+return 1
+"""
+
+
+RELEASE_LOCK_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+EXTEND_LOCK_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+def redis_settings() -> RedisSettings:
+    return RedisSettings(
         host=REDIS_HOST,
         port=REDIS_PORT,
         database=0
     )
-    return await create_pool(settings)
 
 
-@asynccontextmanager
-async def redis_lock(redis, key: str, ttl=30):  # type: ignore
-    if await redis.get(key):  # type: ignore
-        yield Response(status_code=204)
-        return
+async def init_redis():
+    return await create_pool(redis_settings())
 
-    await redis.set(key, "1", ex=ttl)  # type: ignore
+
+@asynccontextmanager
+async def llm_activity(redis: Any, limit: int = 0, wait: float = 0):  # type: ignore
+    """
+    Tracks generations running across all workers, background jobs only use the GPU when there are none.
+    Every generation is its own member of a sorted set scored by its start time, so finishing one never
+    touches another, and members left behind by a crashed worker are pruned once they are old enough.
+    With a `limit`, waits up to `wait` seconds for fewer than `limit` generations to be running
+    and raises TimeoutError otherwise. A free slot is always taken, even with no wait left.
+    """
+    member = uuid.uuid4().hex
+    loop = asyncio.get_running_loop()
+    give_up = loop.time() + wait
+    while True:
+        now = time.time()
+        if await redis.eval(ACQUIRE_SLOT_LUA, 1, LLM_ACTIVE_KEY, now, now - LLM_STALE_AFTER, member, limit):
+            break
+        if loop.time() >= give_up:
+            raise TimeoutError(f"no generation slot within {wait:.1f}s")
+        await asyncio.sleep(LLM_SLOT_POLL)
     try:
         yield
     finally:
-        await redis.delete(key)  # type: ignore
+        await redis.zrem(LLM_ACTIVE_KEY, member)
+
+
+async def llm_busy(redis: Any) -> bool:
+    await redis.zremrangebyscore(LLM_ACTIVE_KEY, "-inf", time.time() - LLM_STALE_AFTER)
+    return await redis.zcard(LLM_ACTIVE_KEY) > 0
+
+
+class Unshared(Exception):
+    """
+    Raised by a flight function whose answer only fits the caller that produced it (a 503 for a saturated
+    queue, ...). It reaches that caller and is never published as a result; the other waiters run their own
+    function while they are within their wait budget, and get the same exception after it.
+    """
+
+    def __init__(self, result: Dict[str, Any]):
+        super().__init__("result is not shared")
+        self.result = result
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent work for the same key.
+    In-process callers share one asyncio task, other workers wait on a Redis lock
+    and pick up the published result instead of generating it again.
+    The leader keeps extending its lock while it works, so waiters only take over from a leader that is gone.
+    A waiter whose leader failed with Unshared retries only within `retry_for` seconds of arriving, so a
+    queue of waiters cannot wait out one busy leader after another.
+    """
+
+    def __init__(
+        self,
+        ttl: int = SINGLE_FLIGHT_TTL,
+        result_ttl: int = SINGLE_FLIGHT_RESULT_TTL,
+        poll: float = SINGLE_FLIGHT_POLL,
+        retry_for: float = LLM_QUEUE_TIMEOUT,
+    ):
+        self.ttl = ttl
+        self.result_ttl = result_ttl
+        self.poll = poll
+        self.retry_for = retry_for
+        self._inflight: Dict[str, asyncio.Task] = {}  # type: ignore
+
+    async def do(self, redis: Any, key: str, fn: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        arrived = loop.time()
+        while True:
+            task = self._inflight.get(key)
+            leader = task is None
+            if task is None:
+                # detached from the caller, so a disconnecting leader does not cancel the waiters
+                task = asyncio.create_task(self._run(redis, key, fn, arrived))
+                self._inflight[key] = task
+                task.add_done_callback(lambda t: self._done(key, t))
+
+            try:
+                return await asyncio.shield(task)
+            except Unshared:
+                # the leader's answer was about its own request, run this one for this caller if there is time left
+                if leader or loop.time() - arrived >= self.retry_for:
+                    raise
+
+    def inflight(self, key: str) -> bool:
+        return key in self._inflight
+
+    def _done(self, key: str, task: asyncio.Task) -> None:  # type: ignore
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()
+
+    async def _run(self, redis: Any, key: str, fn: Callable[[], Awaitable[Dict[str, Any]]], arrived: float) -> Dict[str, Any]:
+        lock_key = f"flight:lock:{key}"
+        result_key = f"flight:result:{key}"
+        busy_key = f"flight:busy:{key}"
+        token = uuid.uuid4().hex
+        loop = asyncio.get_running_loop()
+
+        while True:
+            # a leader that finished just before we got here already published the result
+            raw = await redis.get(result_key)
+            if raw:
+                return orjson.loads(raw)
+
+            if await redis.set(lock_key, token, ex=self.ttl, nx=True):
+                heartbeat = asyncio.create_task(self._extend(redis, lock_key, token))
+                try:
+                    # checked again under the lock, the previous leader may have published in between
+                    raw = await redis.get(result_key)
+                    if raw:
+                        return orjson.loads(raw)
+                    try:
+                        result = await fn()
+                    except Unshared as e:
+                        # kept apart from results, only waiters out of time on other workers read it
+                        await redis.set(busy_key, orjson.dumps(e.result), ex=self.result_ttl)
+                        raise
+                    await redis.set(result_key, orjson.dumps(result), ex=self.result_ttl)
+                    return result
+                finally:
+                    heartbeat.cancel()
+                    await redis.eval(RELEASE_LOCK_LUA, 1, lock_key, token)
+
+            # another worker is generating, wait for its result
+            while await redis.exists(lock_key):
+                await asyncio.sleep(self.poll)
+                raw = await redis.get(result_key)
+                if raw:
+                    return orjson.loads(raw)
+
+            # leader gone without a result, take over unless this caller has waited long enough
+            busy = await redis.get(busy_key)
+            if busy and loop.time() - arrived >= self.retry_for:
+                raise Unshared(orjson.loads(busy))
+
+    async def _extend(self, redis: Any, lock_key: str, token: str) -> None:
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                await redis.eval(EXTEND_LOCK_LUA, 1, lock_key, token, self.ttl)
+            except Exception as e:
+                print(f"[flight] Extending {lock_key} failed: {e}")
+
+
+single_flight = SingleFlight()
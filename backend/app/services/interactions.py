@@ -2,37 +2,53 @@ from typing import Any
 import orjson
 
 from app.models.interaction import InteractionCreate
+from app.utils.metrics import metrics, timed
+from app.utils.write_behind import BatchWriter
+
+
+INSERT_INTERACTION = """
+    INSERT INTO interactions(
+        client_ip, method, path, query_params, semantic_key,
+        headers_json, request_body, response_body,
+        response_status, requested_at, response_headers,
+        body_sha256, body_size
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+interaction_writer = BatchWriter("interactions", INSERT_INTERACTION)
+metrics.gauge("honeypot_interactions_queued", lambda: interaction_writer.stats()["queued"])
 
 
 class InteractionService:
     def __init__(self, db: Any):
         self.db = db
 
+    @timed("interaction_save")
     async def save(self, interaction: InteractionCreate):
         request = interaction.request
+        # spooled bodies only carry their address in the request model
+        spooled = request.body if isinstance(request.body, dict) and "_sha256" in request.body else {}
 
-        await self.db.execute(
-            """
-            INSERT INTO interactions(
-                client_ip, method, path, query_params, semantic_key,
-                headers_json, request_body, response_body,
-                response_status, requested_at, response_headers
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                request.client_ip,
-                request.method,
-                request.full_path,
-                orjson.dumps(request.query_params),
-                request.semantic_key,
-                orjson.dumps(request.headers),
-                interaction.normalize_value(request.body),
-                interaction.normalize_value(interaction.response_body),
-                interaction.response_status,
-                request.requested_at,
-                interaction.normalize_value(interaction.response_headers)
-            ),
+        params = (
+            request.client_ip,
+            request.method,
+            request.full_path,
+            orjson.dumps(request.query_params),
+            request.semantic_key,
+            orjson.dumps(request.headers),
+            interaction.normalize_value(request.body),
+            interaction.normalize_value(interaction.response_body),
+            interaction.response_status,
+            request.requested_at,
+            interaction.normalize_value(interaction.response_headers),
+            spooled.get("_sha256"),
+            spooled.get("_size"),
         )
 
+        if interaction_writer.running:
+            await interaction_writer.put(params)
+            return
+
+        await self.db.execute(INSERT_INTERACTION, params)
         await self.db.commit()
@@ -2,10 +2,98 @@ import time
 import secrets
 import jwt
 
-from typing import Any, Dict
+from pathlib import Path
+from typing import Any, Dict, List, Sequence
 from fastapi import HTTPException
 from app.models.login import LoginRequest
-from app.variables import SECRET
+from app.utils.bloom import BloomFilter
+from app.utils.rate_limit import login_limiter
+from app.utils.write_behind import BatchWriter
+from app.variables import SECRET, DB_PATH, LOGIN_TOKEN_TTL, LOGIN_BLOOM_CAPACITY, LOGIN_BLOOM_ERROR
+
+
+INSERT_USER = "INSERT INTO users (username, password, client_ip) VALUES (?, ?, ?)"
+
+# one set per database file, the users table starts empty with every new dated database.
+# It does not expire: it has to hold every name the users table holds.
+USERS_KEY = f"login:users:{Path(DB_PATH).name}"
+
+class SeenUsernames:
+    """
+    Usernames that already tried to log in, kept out of SQLite so a credential-stuffing burst
+    never touches the database connection that serves resources.
+    A local Bloom filter answers repeats without a round trip, the Redis set is shared by every worker.
+    A name is only marked once its credentials are committed, so a lost write never hides it for good.
+    """
+
+    def __init__(self, key: str = USERS_KEY, capacity: int = LOGIN_BLOOM_CAPACITY, error_rate: float = LOGIN_BLOOM_ERROR):
+        self.key = key
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.redis: Any = None
+
+    async def load(self, db: Any, redis: Any) -> None:
+        """
+        Seeds the set from the users table, for databases written before it existed.
+        """
+        self.redis = redis
+        batch = []
+        async with db.execute("SELECT DISTINCT username FROM users") as cur:
+            async for row in cur:
+                if row[0] is None:
+                    continue
+                batch.append(row[0])
+                self.bloom.add(row[0])
+                if len(batch) >= 1000:
+                    await redis.sadd(self.key, *batch)
+                    batch = []
+        if batch:
+            await redis.sadd(self.key, *batch)
+
+    async def seen_before(self, redis: Any, username: str) -> bool:
+        # a false positive only means a new username gets the same 401 as a repeated one
+        if username in self.bloom:
+            return True
+
+        try:
+            seen = bool(await redis.sismember(self.key, username))
+        except Exception as e:
+            print(f"[login] Username lookup failed: {e}")
+            return False
+
+        if seen:
+            self.bloom.add(username)
+        return seen
+
+    async def mark(self, redis: Any, usernames: List[str]) -> None:
+        for username in usernames:
+            self.bloom.add(username)
+        if redis is None or not usernames:
+            return
+
+        try:
+            await redis.sadd(self.key, *usernames)
+        except Exception as e:
+            print(f"[login] Marking {len(usernames)} usernames failed: {e}")
+
+    async def written(self, rows: List[Sequence[Any]]) -> None:
+        await self.mark(self.redis, [row[0] for row in rows if row[0] is not None])
+
+
+seen_usernames = SeenUsernames()
+
+# blocks instead of dropping when full, a captured credential is the point of the honeypot
+credential_writer = BatchWriter("users", INSERT_USER, policy="block", on_written=seen_usernames.written)
+
+
+def issue_token(username: str, client_ip: str) -> str:
+    payload: Dict[str, Any] = {
+        "sub": username,
+        "ip": client_ip,
+        "iat": int(time.time()),
+        "exp": int(time.time()) + LOGIN_TOKEN_TTL
+    }
+
+    return jwt.encode(payload, SECRET, algorithm="HS512")  # type:ignore
 
 
 class LoginService:
@@ -16,28 +104,32 @@ class LoginService:
     async def login(self, data: LoginRequest, client_ip: str) -> Dict[str, str]:
         username = data.username
 
-        async with self.db.execute("SELECT 1 FROM users WHERE username = ?", (username,)) as cur:
-            exists = await cur.fetchone()
-
-        if exists:
+        if await seen_usernames.seen_before(self.redis, username):
             raise HTTPException(status_code=401, detail="Invalid username or password")
 
-        await self.db.execute(
-            "INSERT INTO users (username, password, client_ip) VALUES (?, ?, ?)",
-            (username, data.password, client_ip)
-        )
-        await self.db.commit()
+        # captured before the limit is checked, the limit only decides what the client gets back
+        await self.capture(username, data.password, client_ip)
+
+        limited, retry_after = await login_limiter.hit(self.redis, client_ip)
+        if limited:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many login attempts",
+                headers={"Retry-After": str(retry_after)}
+            )
 
         if secrets.choice([True, False]) is False:
             raise HTTPException(status_code=401, detail="Invalid username or password")
 
-        payload: Dict[str, Any] = {
-            "sub": username,
-            "ip": client_ip,
-            "iat": int(time.time()),
-            "exp": int(time.time()) + 9000
-        }
+        return {"access_token": issue_token(username, client_ip)}
+
+    async def capture(self, username: str, password: str, client_ip: str) -> None:
+        params = (username, password, client_ip)
 
-        token = jwt.encode(payload, SECRET, algorithm="HS512")  # type:ignore
+        if credential_writer.running:
+            await credential_writer.put(params)
+            return
 
-        return {"access_token": token}
+        await self.db.execute(INSERT_USER, params)
+        await self.db.commit()
+        await seen_usernames.mark(self.redis, [username])
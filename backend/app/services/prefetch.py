@@ -0,0 +1,145 @@
+import orjson
+
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple
+
+from app.models.requests import RequestValidator
+from app.redis_db import llm_busy, Unshared
+from app.services.resources import ResourceService
+from app.variables import PREFETCH_WORDLISTS, PREFETCH_REQUESTS_FILE, PREFETCH_HISTORY_LIMIT, PREFETCH_BATCH, \
+    PREFETCH_SEEN_TTL
+
+
+PREFETCH_HEADERS = {
+    "host": "localhost",
+    "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36",
+    "accept": "*/*",
+}
+
+Candidate = Tuple[str, str, Dict[str, Any] | None]
+
+
+class PrefetchService:
+    """
+    Warms resources for paths scanners are likely to probe, while the GPU is idle.
+    Candidates come from wordlists, a JSONL request log and the most requested paths seen so far.
+    """
+
+    def __init__(self, db: Any, redis: Any):
+        self.db = db
+        self.redis = redis
+        self.resources = ResourceService(db, redis)
+
+    async def run(self, limit: int = PREFETCH_BATCH) -> int:
+        generated = 0
+        for method, path, query_params in await self.candidates():
+            if generated >= limit:
+                break
+
+            if await llm_busy(self.redis):
+                # interactive misses have the GPU, try again on the next run
+                break
+
+            seen_key = f"prefetch:seen:{method}:{path}:{orjson.dumps(query_params).decode()}"
+            if not await self.redis.set(seen_key, "1", ex=PREFETCH_SEEN_TTL, nx=True):
+                continue
+
+            try:
+                req = RequestValidator(
+                    client_ip=None,
+                    full_path=path,
+                    method=method,
+                    query_params=query_params,
+                    body=None,
+                    headers=PREFETCH_HEADERS,
+                )
+            except Exception:
+                # rejected by the same validation as live traffic, nothing to warm
+                continue
+
+            try:
+                if await self.resources.prefetch(req):
+                    generated += 1
+            except Unshared:
+                # nothing was generated, keep the path a candidate and leave the GPU to live traffic
+                await self.redis.delete(seen_key)
+                break
+            except Exception as e:
+                print(f"[prefetch] {method} /{path} failed: {e}")
+
+        if generated:
+            print(f"[prefetch] Generated {generated} resources")
+        return generated
+
+    async def candidates(self) -> List[Candidate]:
+        seen = set()
+        result: List[Candidate] = []
+
+        for source in (self.from_history(), self.from_requests_file(), self.from_wordlists()):
+            for method, path, query_params in await source:
+                for variant in path_variants(path):
+                    key = (method, variant, orjson.dumps(query_params))
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    result.append((method, variant, query_params))
+
+        return result
+
+    async def from_history(self) -> List[Candidate]:
+        q = """
+            SELECT method, path, COUNT(*) AS hits
+            FROM interactions
+            WHERE method = 'GET'
+            GROUP BY method, path
+            ORDER BY hits DESC
+            LIMIT ?
+        """
+        async with self.db.execute(q, (PREFETCH_HISTORY_LIMIT,)) as cur:
+            rows = await cur.fetchall()
+        return [(row[0], row[1], None) for row in rows]
+
+    async def from_requests_file(self) -> List[Candidate]:
+        if not PREFETCH_REQUESTS_FILE:
+            return []
+        path = Path(PREFETCH_REQUESTS_FILE)
+        if not path.exists():
+            print(f"[prefetch] Requests file {path} not found")
+            return []
+
+        result: List[Candidate] = []
+        for line in path.read_text(encoding="utf-8").splitlines():
+            try:
+                entry = orjson.loads(line)
+            except Exception:
+                continue
+            if not isinstance(entry, dict) or not entry.get("path"):
+                continue
+            result.append((str(entry.get("method", "GET")).upper(), str(entry["path"]), entry.get("query_params") or None))
+        return result
+
+    async def from_wordlists(self) -> List[Candidate]:
+        return [("GET", path, None) for path in read_wordlists(PREFETCH_WORDLISTS)]
+
+
+def read_wordlists(files: List[str]) -> Iterator[str]:
+    for name in files:
+        path = Path(name)
+        if not path.exists():
+            continue
+        for line in path.read_text(encoding="utf-8", errors="replace").splitlines():
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line
+
+
+def path_variants(path: str) -> List[str]:
+    # router paths never carry the leading slash
+    path = path.strip().lstrip("/")
+    if not path:
+        return [""]
+    if path.endswith("/"):
+        return [path, path.rstrip("/")]
+    if "." in path.rsplit("/", 1)[-1]:
+        return [path]
+    return [path, path + "/"]
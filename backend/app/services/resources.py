@@ -1,16 +1,39 @@
-from typing import Any, Dict, List
+import asyncio
+import time
+import httpx
+
+from typing import Any, Dict, List, Set
 from fastapi import HTTPException
-import numpy as np
-from fastapi.responses import HTMLResponse, JSONResponse, Response
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 
 
 from app.models.requests import RequestValidator
-from app.models.resources import ResourceCreate, ResourceDB
+from app.models.resources import ResourceCreate, ResourceDB, render_body, compress_body, compress_br, content_etag
 from app.services.interactions import InteractionService
 from app.models.interaction import InteractionCreate
-from app.models.llm import DEFAULT_HEADERS
-from app.redis_db import redis_lock
-from app.utils.llm import embed_text, call_llm
+from app.models.llm import DEFAULT_HEADERS, LLMResponse, LLMStreamParser, default_headers, busy_response
+from app.redis_db import single_flight, llm_activity, Unshared
+from app.utils.scheduler import llm_scheduler, SchedulerFull, INTERACTIVE, PREFETCH
+from app.utils.cache import resource_cache
+from app.utils.llm import call_llm, stream_llm, NoBackendAvailable
+from app.utils.template_responses import template_response
+from app.utils.templates import Templates, template_registry
+from app.utils.embeddings import embedding_cache
+from app.utils.rate_limit import miss_limiter
+from app.utils.metrics import metrics, timed
+from app.utils.requests_utils import accepts_encoding, not_modified
+from app.utils.vector_index import add_vector, get_vector_index
+from app.utils.sync import publish
+from app.variables import VECTOR_TOP_K, VECTOR_SIMILARITY_THRESHOLD, LLM_STREAM, LLM_DEADLINE, \
+    LLM_CONCURRENCY, LLM_QUEUE_TIMEOUT
+
+
+RESOURCE_COLUMNS = (
+    "id, response_body, response_status, response_headers, response_raw, response_gzip, response_br, "
+    "etag, media_type, updated_at"
+)
+
+_background: Set[asyncio.Task] = set()  # type: ignore
 
 
 class ResourceService:
@@ -20,19 +43,17 @@ class ResourceService:
         self.interaction_service = InteractionService(db)
 
     async def get(self, req: RequestValidator) -> Response:
-        async with redis_lock(self.redis, req.hash):
-            return await self._handle_get(req)
+        return await self._handle_get(req)
 
     async def crud(self, req: RequestValidator, token: Dict[str, Any] | None) -> Response:
-        async with redis_lock(self.redis, req.hash):
-            return await self._handle_crud(req, token)
+        return await self._handle_crud(req, token)
 
     async def delete(self, req: RequestValidator) -> Response:
         interaction = InteractionCreate(
             request=req,
             response_body=None,
             response_status=204,
-            response_headers=DEFAULT_HEADERS
+            response_headers=default_headers()
         )
         await self.interaction_service.save(interaction)
         return self.respond(interaction.response_body, 204, interaction.response_headers)
@@ -40,10 +61,17 @@ class ResourceService:
     async def _handle_get(self, req: RequestValidator):
         res = await self.find_resource(req.full_path)
         embedding = None
+        canonical = req.canonicalize(req.method)
+        templates = template_registry.current
+        templated = None
         if not res:
-            embedding = await embed_text(req.semantic_key)
-            canonical = req.canonicalize(req.method)
+            # emulated files and attack templates never need the embedder, the rate limit or the model
+            templated = template_response(req.method, req.full_path, req.query_params, req.body, templates)
+            if templated is None:
+                embedding = await embedding_cache.embed(self.redis, req.semantic_key, req.client_ip)
             res = await self.find_resource(req.full_path, canonical, embedding)
+            if not res:
+                metrics.inc("honeypot_lookup_total", tier="miss", source="llm" if templated is None else "template")
 
         if res:
             interaction = InteractionCreate(
@@ -53,30 +81,86 @@ class ResourceService:
                 response_headers=res.response_headers
             )
             await self.interaction_service.save(interaction)
-            return self.respond(res.response_body, res.response_status, res.response_headers)
+            return self.respond_resource(res, req)
 
-        limited, ttl = await self.rate_limit_new_get(req.client_ip)
-        if limited:
-            return JSONResponse(
-                {"error": "Rate limit exceeded. Try again later.", "retry_after": ttl},
-                status_code=429
+        if templated is not None:
+            result = await single_flight.do(
+                self.redis, canonical, lambda: self._store_templated(req, canonical, None, templated, templates)  # type: ignore
             )
+            llm_resp = LLMResponse.model_validate(result)
+        else:
+            # limited before joining a flight, so one noisy client cannot hand its 429 to everyone waiting on the path;
+            # joining a generation that is already running costs nothing and is not counted
+            if not single_flight.inflight(canonical):
+                limited, ttl = await miss_limiter.hit(self.redis, req.client_ip)
+                if limited:
+                    body = {"error": "Rate limit exceeded. Try again later.", "retry_after": ttl}
+                    interaction = InteractionCreate(request=req, response_body=body, response_status=429, response_headers={})
+                    await self.interaction_service.save(interaction)
+                    return self.respond(body, 429, {}, req)
+
+            # no match → call LLM, concurrent misses for the same canonical key share one generation
+            events: asyncio.Queue = asyncio.Queue()  # type: ignore
+            flight = asyncio.ensure_future(single_flight.do(
+                self.redis, canonical, lambda: self._generate(req, canonical, embedding, events)
+            ))
+
+            if LLM_STREAM:
+                streamed = await self._stream_response(req, flight, events)
+                if streamed is not None:
+                    return streamed
 
-        # no match → call LLM
-        llm_resp = await call_llm(
-            req.headers, req.method, req.full_path, req.body, req.query_params
-        )
+            try:
+                result = await flight
+            except Unshared as e:
+                result = e.result
+            llm_resp = LLMResponse.model_validate(result)
 
-        new_resource = ResourceCreate(
-            path=req.full_path,
-            canonical_key=canonical,
+        interaction = InteractionCreate(
+            request=req,
             response_body=llm_resp.body,
             response_status=llm_resp.status_code,
-            response_headers=llm_resp.headers,
-            embedding=embedding
+            response_headers=llm_resp.headers
         )
+        await self.interaction_service.save(interaction)
+        return self.respond(llm_resp.body, llm_resp.status_code, llm_resp.headers, req)
 
-        await self.create(new_resource)
+    async def _stream_response(self, req: RequestValidator, flight: asyncio.Future, events: asyncio.Queue) -> Response | None:  # type: ignore
+        """
+        Sends status and headers as soon as the model has written them and streams the body.
+        Returns None when this request is not the one generating, or the envelope could not be streamed.
+        """
+        first = asyncio.ensure_future(events.get())
+        await asyncio.wait({flight, first}, return_when=asyncio.FIRST_COMPLETED)
+        if not first.done():
+            first.cancel()
+            return None
+
+        event = first.result()
+        if event[0] != "head":
+            return None
+
+        _, status, headers, media_type = event
+
+        task = asyncio.create_task(self._save_generated(req, flight))
+        _background.add(task)
+        task.add_done_callback(_background.discard)
+
+        async def body():  # type: ignore
+            while True:
+                event = await events.get()
+                if event[0] == "end":
+                    break
+                yield event[1]
+
+        return StreamingResponse(body(), status_code=status, headers=clean_headers(headers), media_type=media_type)
+
+    async def _save_generated(self, req: RequestValidator, flight: asyncio.Future) -> None:  # type: ignore
+        try:
+            llm_resp = LLMResponse.model_validate(await flight)
+        except Exception as e:
+            print(f"[llm] Streamed generation failed: {e}")
+            return
 
         interaction = InteractionCreate(
             request=req,
@@ -85,14 +169,128 @@ class ResourceService:
             response_headers=llm_resp.headers
         )
         await self.interaction_service.save(interaction)
-        return self.respond(llm_resp.body, llm_resp.status_code, llm_resp.headers)
+
+    async def _generate(
+        self,
+        req: RequestValidator,
+        canonical: str,
+        embedding: List[float] | None,
+        events: asyncio.Queue | None = None,  # type: ignore
+        priority: int = INTERACTIVE,
+    ) -> Dict[str, Any]:
+        # one template version for the whole generation, even if a reload lands meanwhile
+        templates = template_registry.current
+
+        templated = template_response(req.method, req.full_path, req.query_params, req.body, templates)
+        if templated is not None:
+            return await self._store_templated(req, canonical, embedding, templated, templates)
+
+        try:
+            # the local queue orders this worker's jobs, the Redis set caps generations across all workers,
+            # both waits come out of the same LLM_QUEUE_TIMEOUT
+            queued = time.perf_counter()
+            async with llm_scheduler.slot(req.client_ip, priority):
+                left = max(0.0, LLM_QUEUE_TIMEOUT - (time.perf_counter() - queued))
+                async with llm_activity(self.redis, LLM_CONCURRENCY, left), \
+                        asyncio.timeout(LLM_DEADLINE) as deadline:
+                    if LLM_STREAM and events is not None:
+                        llm_resp = await self._stream_llm(req, events, templates, deadline)
+                    else:
+                        llm_resp = await call_llm(
+                            req.headers, req.method, req.full_path, req.body, req.query_params, templates
+                        )
+        except (SchedulerFull, TimeoutError, NoBackendAvailable, httpx.HTTPError) as e:
+            # saturated, past its deadline or no backend answering: a plain 503 rather than a 500 that
+            # gives the honeypot away, and a later request can still generate it
+            print(f"[llm] Generation for {req.full_path} skipped: {type(e).__name__} {e}")
+            metrics.inc("honeypot_llm_skipped_total", reason=type(e).__name__)
+            if events is not None:
+                events.put_nowait(("end",))
+            # not stored and not shared, other waiters try for themselves
+            raise Unshared(busy_response())
+
+        await self._store_generated(req, canonical, embedding, llm_resp, templates)
+        return llm_resp.model_dump()
+
+    async def _store_templated(
+        self,
+        req: RequestValidator,
+        canonical: str,
+        embedding: List[float] | None,
+        templated: LLMResponse,
+        templates: Templates,
+    ) -> Dict[str, Any]:
+        await self._store_generated(req, canonical, embedding, templated, templates)
+        return templated.model_dump()
+
+    async def _store_generated(
+        self,
+        req: RequestValidator,
+        canonical: str,
+        embedding: List[float] | None,
+        llm_resp: LLMResponse,
+        templates: Templates,
+    ) -> None:
+        new_resource = ResourceCreate(
+            path=req.full_path,
+            canonical_key=canonical,
+            response_body=llm_resp.body,
+            response_status=llm_resp.status_code,
+            response_headers=llm_resp.headers,
+            embedding=embedding,
+            template_version=templates.version
+        )
+
+        await self.create(new_resource)
+
+    async def prefetch(self, req: RequestValidator) -> bool:
+        """
+        Generates and stores the resource for `req` ahead of time, without logging an interaction.
+        Returns False when something already answers it, raises Unshared when the LLM was too busy to generate it.
+        """
+        canonical = req.canonicalize(req.method)
+        if await self.find_resource(req.full_path, canonical):
+            return False
+
+        embedding = await embedding_cache.embed(self.redis, req.semantic_key)
+        if await self.find_resource(req.full_path, canonical, embedding):
+            return False
+
+        await single_flight.do(
+            self.redis, canonical, lambda: self._generate(req, canonical, embedding, priority=PREFETCH)
+        )
+        return True
+
+    async def _stream_llm(
+        self,
+        req: RequestValidator,
+        events: asyncio.Queue,  # type: ignore
+        templates: Templates,
+        deadline: asyncio.Timeout | None = None,
+    ) -> LLMResponse:
+        parser = LLMStreamParser()
+        start = time.perf_counter()
+        try:
+            with metrics.span("stream_llm"):
+                async for delta in stream_llm(req.headers, req.method, req.full_path, req.body, req.query_params, templates):
+                    if not parser.text:
+                        metrics.observe("llm_first_token", time.perf_counter() - start)
+                    for event in parser.feed(delta):
+                        if event[0] == "head" and deadline is not None:
+                            # a 200 is on its way to the client, cutting it short now would truncate it
+                            deadline.reschedule(None)
+                        events.put_nowait(event)
+        finally:
+            events.put_nowait(("end",))
+
+        return LLMResponse.model_validate(parser.text)
 
     async def _handle_crud(self, req: RequestValidator, token: Dict[str, Any] | None):
         existing = await self.find_resource(req.full_path)
         embedding = None
         canonical = None
         if not existing:
-            embedding = await embed_text(req.semantic_key)
+            embedding = await embedding_cache.embed(self.redis, req.semantic_key, req.client_ip)
             canonical = req.canonicalize(req.method)
             existing = await self.find_resource(req.full_path, canonical, embedding)
 
@@ -137,7 +335,7 @@ class ResourceService:
         )
         await self.interaction_service.save(interaction)
 
-        return self.respond(response_body, response_status, response_headers)
+        return self.respond(response_body, response_status, response_headers, req)
 
     async def find_resource(self, path: str, canonical_key: str | None = None, embedding: List[float] | str | None = None):
         res = await self.find_by_path(path)
@@ -158,66 +356,83 @@ class ResourceService:
 
         return None
 
+    @timed("find_by_path")
     async def find_by_path(self, path: str) -> ResourceDB | None:
-        q = "SELECT id, response_body, response_status, response_headers FROM resources WHERE path = ?"
+        cache_key = f"path:{path}"
+        cached = resource_cache.get(cache_key)
+        if cached:
+            metrics.inc("honeypot_lookup_total", tier="path", source="memory")
+            return cached
+
+        q = f"SELECT {RESOURCE_COLUMNS} FROM resources WHERE path = ?"
         async with self.db.execute(q, (path,)) as cur:
             row = await cur.fetchone()
 
         if not row:
             return None
 
-        rid, body_raw, status, headers = row
-        resource = {"id": rid, "response_body": body_raw, "response_status": status, "response_headers": headers}
+        resource = dict(row)
 
-        return ResourceDB.from_row(resource)
+        res = ResourceDB.from_row(resource)
+        resource_cache.set(cache_key, res, ResourceDB.row_size(resource), tag=res.id)
+        metrics.inc("honeypot_lookup_total", tier="path", source="db")
+        return res
 
+    @timed("find_canonical")
     async def find_canonical(self, canonical_key: str) -> ResourceDB | None:
-        q = "SELECT id, response_body, response_status, response_headers FROM resources WHERE canonical_key = ?"
+        cache_key = f"canonical:{canonical_key}"
+        cached = resource_cache.get(cache_key)
+        if cached:
+            metrics.inc("honeypot_lookup_total", tier="canonical", source="memory")
+            return cached
+
+        q = f"SELECT {RESOURCE_COLUMNS} FROM resources WHERE canonical_key = ?"
         async with self.db.execute(q, (canonical_key,)) as cur:
             row = await cur.fetchone()
 
         if not row:
             return None
 
-        rid, body_raw, status, headers = row
-        resource = {"id": rid, "response_body": body_raw, "response_status": status, "response_headers": headers}
+        resource = dict(row)
 
-        return ResourceDB.from_row(resource)
+        res = ResourceDB.from_row(resource)
+        resource_cache.set(cache_key, res, ResourceDB.row_size(resource), tag=res.id)
+        metrics.inc("honeypot_lookup_total", tier="canonical", source="db")
+        return res
 
-    async def find_vector(self, embedding: List[float], threshold: float = 0.4) -> ResourceDB | None:
-        vec_blob = np.asarray(embedding, dtype=np.float32).tobytes()
+    @timed("find_vector")
+    async def find_vector(self, embedding: List[float], threshold: float = VECTOR_SIMILARITY_THRESHOLD) -> ResourceDB | None:
+        for rid, similarity in get_vector_index().search(embedding, VECTOR_TOP_K):
+            if similarity < threshold:
+                # something was close, just not close enough: a rising rate means the vector tier is degrading
+                metrics.inc("honeypot_lookup_total", tier="vector", source="below_threshold")
+                break
 
-        async with self.db.execute("SELECT COUNT(*) FROM embeddings") as cur:
-            (count,) = await cur.fetchone()
-            if count == 0:
-                return None
+            res = await self.find_by_id(rid)
+            if res:
+                metrics.inc("honeypot_lookup_total", tier="vector", source="index")
+                return res
 
-        q = """
-        SELECT r.id, r.response_body, r.response_status, v.distance, r.response_headers
-        FROM (
-            SELECT rowid, distance
-            FROM embeddings
-            WHERE vss_search(embedding, ?)
-            LIMIT 1
-        ) AS v
-        JOIN resources r ON r.id = v.rowid;
-        """
+        return None
 
-        async with self.db.execute(q, (vec_blob,)) as cur:
+    async def find_by_id(self, resource_id: int) -> ResourceDB | None:
+        cache_key = f"id:{resource_id}"
+        cached = resource_cache.get(cache_key)
+        if cached:
+            return cached
+
+        q = f"SELECT {RESOURCE_COLUMNS} FROM resources WHERE id = ?"
+        async with self.db.execute(q, (resource_id,)) as cur:
             row = await cur.fetchone()
 
         if not row:
             return None
 
-        rid, body_raw, status, distance, headers = row
-
-        similarity = float(np.exp(-distance / 100))
-        if similarity < threshold:
-            return None
-
-        resource = {"id": rid, "response_body": body_raw, "response_status": status, "response_headers": headers}
+        resource = dict(row)
 
-        return ResourceDB.from_row(resource)
+        res = ResourceDB.from_row(resource)
+        resource_cache.set(cache_key, res, ResourceDB.row_size(resource), tag=res.id)
+        return res
 
     async def create(self, resource: ResourceCreate):
         insert_q, params = resource.get_insert_query()
@@ -234,63 +449,97 @@ class ResourceService:
             print("RESOURCE INSERT ERROR:", e)
             raise
 
+        resource_cache.delete(f"path:{resource.path}")
+        resource_cache.delete(f"canonical:{resource.canonical_key}")
+
+        if resource.embedding:
+            await add_vector(rid, resource.embedding, self.redis)
+
+        await publish(self.redis, "created", id=rid, path=resource.path, canonical_key=resource.canonical_key)
+
     async def update(self, resource_id: int, body: Any):
-        q = "UPDATE resources SET response_body = ? WHERE id = ?"
+        q = """
+            UPDATE resources
+            SET response_body = ?, response_raw = ?, response_gzip = ?, response_br = ?, etag = ?, media_type = ?,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        """
         blob = ResourceCreate(response_body=body, response_status=204).get_blob('response_body')
-        await self.db.execute(q, (blob, resource_id))
+        raw, media_type = render_body(body)
+        params = (blob, raw, compress_body(raw), compress_br(raw), content_etag(raw, media_type), media_type, resource_id)
+        await self.db.execute(q, params)
         await self.db.commit()
+        resource_cache.invalidate_tag(resource_id)
+        await publish(self.redis, "updated", id=resource_id)
 
-    async def rate_limit_new_get(self, client_ip: str, limit: int = 10, window: int = 900):
-        key = f"rate:newget:{client_ip}"
+    def respond(self, body: Any, status=200, headers=DEFAULT_HEADERS, req: RequestValidator | None = None) -> Response:
+        raw, media_type = render_body(body)
+        return self.respond_raw(raw, media_type, status, headers, req, compress_body(raw))
 
-        count = await self.redis.incr(key)
-        if count == 1:
-            await self.redis.expire(key, window)
+    def respond_resource(self, res: ResourceDB, req: RequestValidator) -> Response:
+        return self.respond_raw(
+            res.response_raw, res.media_type, res.response_status, res.response_headers, req,
+            res.response_gzip, res.response_br, res.etag, res.last_modified
+        )
 
-        if count > limit:
-            ttl = await self.redis.ttl(key)
-            return True, ttl
+    @timed("respond")
+    def respond_raw(
+        self,
+        raw: bytes,
+        media_type: str,
+        status=200,
+        headers=DEFAULT_HEADERS,
+        req: RequestValidator | None = None,
+        gzipped: bytes | None = None,
+        br: bytes | None = None,
+        etag: str | None = None,
+        last_modified: str | None = None,
+    ) -> Response:
+        clean = clean_headers(headers)
+        req_headers = (req.headers or {}) if req else {}
+
+        accept = req_headers.get("accept-encoding", "")
+        encoding = None
+        if br is not None and accepts_encoding(accept, "br"):
+            encoding, raw = "br", br
+        elif gzipped is not None and accepts_encoding(accept, "gzip"):
+            encoding, raw = "gzip", gzipped
+
+        if gzipped is not None or br is not None:
+            clean["Vary"] = "Accept-Encoding"
+
+        if etag:
+            clean["ETag"] = f'{etag[:-1]}-{encoding}"' if encoding else etag
+            if last_modified:
+                clean["Last-Modified"] = last_modified
+            if status == 200 and req and req.method in ("GET", "HEAD") and not_modified(req_headers, etag, last_modified):
+                return Response(status_code=304, headers=clean)
+
+        if encoding:
+            clean["Content-Encoding"] = encoding
 
-        return False, None
+        return Response(
+            content=raw,
+            status_code=status,
+            media_type=media_type,
+            headers=clean
+        )
 
-    def respond(self, body: Any, status=200, headers=DEFAULT_HEADERS) -> Response:
-        clean = DEFAULT_HEADERS
 
-        if isinstance(headers, dict):
-            forbidden = {"content-length", "transfer-encoding", "date", "server"}
+def clean_headers(headers: Any) -> Dict[str, str]:
+    if not isinstance(headers, dict):
+        return default_headers()
 
-            clean = {}
-            for k, v in headers.items():
-                # pomiń zabronione
-                key_lower = k.lower()
-                if key_lower in forbidden or key_lower == "content-type":
-                    continue
-            try:
-                clean[k] = str(v)
-            except:
-                pass
-
-        # JSON dict
-        if isinstance(body, dict):
-            return JSONResponse(
-                content=body,
-                status_code=status,
-                headers=clean
-            )
+    forbidden = {"content-length", "transfer-encoding", "date", "server", "content-type", "content-encoding", "etag", "last-modified"}
 
-        # HTML
-        if isinstance(body, str) and "<html" in body.lower():
-            return HTMLResponse(
-                content=body,
-                status_code=status,
-                media_type="text/html",
-                headers=clean
-            )
+    clean = {}
+    for k, v in headers.items():
+        # pomiń zabronione
+        if k.lower() in forbidden:
+            continue
+        try:
+            clean[k] = str(v)
+        except:
+            pass
 
-        # plain text
-        return Response(
-            content=str(body),
-            status_code=status,
-            media_type="text/plain",
-            headers=clean
-        )
+    return clean
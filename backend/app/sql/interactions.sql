@@ -7,6 +7,8 @@ CREATE TABLE IF NOT EXISTS interactions (
     semantic_key TEXT NOT NULL,
     headers_json TEXT,
     request_body TEXT,
+    body_sha256 TEXT,
+    body_size INTEGER,
     response_body TEXT,
     response_status INTEGER,
     response_raw TEXT,
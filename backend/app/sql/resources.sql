@@ -5,10 +5,17 @@ CREATE TABLE IF NOT EXISTS resources (
     response_status INTEGER,
     response_headers TEXT,
     path TEXT,
+    response_raw BLOB,
+    response_gzip BLOB,
+    response_br BLOB,
+    etag TEXT,
+    media_type TEXT,
+    template_version TEXT,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
     updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
 );
 
-CREATE VIRTUAL TABLE embeddings USING vss0(
-    embedding(768)
+CREATE TABLE IF NOT EXISTS embeddings (
+    rowid INTEGER PRIMARY KEY,
+    embedding BLOB
 );
\ No newline at end of file
@@ -1,48 +1,138 @@
-from typing import Any, Dict, Tuple
-from app.variables import ATTACK_TEMPLATE
+import orjson
 
+from collections import deque
+from typing import Any, Dict, List, Tuple
+from app.utils.requests_utils import url_decode
 
-def detect_attack(
-    method: str,
-    path: str,
-    query_params: Dict[str, Any] | None,
-    body: Dict[str, Any] | None,
-    attack_template: Dict[str, Any] | None = ATTACK_TEMPLATE,
-) -> Tuple[str, str, Dict[str, Any], Dict[str, str]] | Tuple[None, None, None, None]:
-    if attack_template is None:
-        return None, None, None, None
 
-    dynamic_fields = attack_template.get("dynamic_fields", {})
-    emulated_files = attack_template.get("emulated_files", {}).get("files", {})
+NON_ATTACK_KEYS = ("dynamic_fields", "emulated_files", "fallback")
+
+
+class AttackMatcher:
+    """
+    Aho-Corasick automaton over every template pattern, built once per template version.
+    One pass over the request finds all patterns regardless of how many signatures there are.
+    A category scores the summed weight (default 1) of its distinct patterns that matched.
+    """
+
+    def __init__(self, attack_template: Dict[str, Any] | None):
+        self.categories: Dict[str, str] = {}
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]
+        self._patterns: List[List[Tuple[str, float]]] = []
+
+        patterns: Dict[str, int] = {}
+        for key, entry in (attack_template or {}).items():
+            if key in NON_ATTACK_KEYS or not isinstance(entry, dict):
+                continue
+            if "patterns" not in entry or "template" not in entry:
+                continue
+
+            self.categories[key] = entry["template"]
+            weight = float(entry.get("weight", 1))
+            for p in entry["patterns"]:
+                p = p.lower()
+                if not p:
+                    continue
+                if p not in patterns:
+                    patterns[p] = len(self._patterns)
+                    self._patterns.append([])
+                    self._insert(p, patterns[p])
+                self._patterns[patterns[p]].append((key, weight))
+
+        self._link()
+
+    def _insert(self, pattern: str, pid: int) -> None:
+        state = 0
+        for ch in pattern:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append(pid)
+
+    def _link(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find(self, haystack: str) -> set[int]:
+        goto, fail, out = self._goto, self._fail, self._out
+        found: set[int] = set()
+        state = 0
+        for ch in haystack:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
 
-    haystack = " ".join([
+    def scores(self, haystack: str) -> Dict[str, float]:
+        scores: Dict[str, float] = {}
+        for pid in self.find(haystack):
+            for key, weight in self._patterns[pid]:
+                scores[key] = scores.get(key, 0) + weight
+        return scores
+
+
+def request_haystack(method: str, path: str, query_params: Dict[str, Any] | None, body: Dict[str, Any] | None) -> str:
+    """
+    Lowercased request text, raw and URL-decoded, so both encoded payloads and encoding tricks match.
+    """
+    raw = " ".join([
         (method or ""),
         (path or ""),
-        str(query_params or ""),
-        str(body or "")
+        orjson.dumps(query_params).decode() if query_params else "",
+        orjson.dumps(body).decode() if body else "",
     ]).lower()
 
-    best_key = None
-    best_template = None
-    best_score = -1
+    decoded = url_decode(raw)
+    return raw if decoded == raw else f"{raw}\n{decoded}"
 
-    for key, entry in attack_template.items():
-        if key in ("dynamic_fields", "emulated_files", "fallback"):
-            continue
-        if not isinstance(entry, dict):
-            continue
-        if "patterns" not in entry or "template" not in entry:
-            continue
 
-        patterns = entry["patterns"]  # type: ignore
-        score = sum(1 for p in patterns if p.lower() in haystack)  # type: ignore
+def match_attacks(
+    method: str,
+    path: str,
+    query_params: Dict[str, Any] | None,
+    body: Dict[str, Any] | None,
+    matcher: AttackMatcher,
+) -> Dict[str, float]:
+    return matcher.scores(request_haystack(method, path, query_params, body))
 
-        if score > best_score and score > 0:
-            best_score = score
-            best_key = key
-            best_template = entry["template"]  # type: ignore
 
-    if best_key is None:
+def detect_attack(
+    method: str,
+    path: str,
+    query_params: Dict[str, Any] | None,
+    body: Dict[str, Any] | None,
+    attack_template: Dict[str, Any] | None,
+    matcher: AttackMatcher | None = None,
+) -> Tuple[str, str, Dict[str, Any], Dict[str, str]] | Tuple[None, None, None, None]:
+    if attack_template is None:
+        return None, None, None, None
+
+    matcher = matcher or AttackMatcher(attack_template)
+    scores = match_attacks(method, path, query_params, body, matcher)
+    if not scores:
         return None, None, None, None
 
-    return best_key, best_template, dynamic_fields, emulated_files  # type: ignore
+    # ties go to the category listed first in the templates
+    best_key = max(matcher.categories, key=lambda k: scores.get(k, 0))
+
+    dynamic_fields = attack_template.get("dynamic_fields", {})
+    emulated_files = attack_template.get("emulated_files", {}).get("files", {})
+
+    return best_key, matcher.categories[best_key], dynamic_fields, emulated_files  # type: ignore
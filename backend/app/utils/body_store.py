@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, List, Tuple
+
+from app.variables import BODY_STORE_DIR, BODY_PREVIEW_BYTES, BODY_STORE_MAX_BYTES, BODY_STORE_SCAN_INTERVAL
+
+
+# uploads still being written are never older than this, leftovers of a crashed worker are
+PART_MAX_AGE = 3600
+
+
+class SpooledBody:
+    """
+    Receives a request body chunk by chunk into a temp file, hashing it on the way.
+    """
+
+    def __init__(self, store: "BodyStore"):
+        self.store = store
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.preview = b""
+        self._file: BinaryIO | None = None
+        self._tmp: str | None = None
+
+    async def write(self, chunk: bytes) -> None:
+        if self._file is None:
+            await asyncio.to_thread(self.store.directory.mkdir, parents=True, exist_ok=True)
+            fd, self._tmp = tempfile.mkstemp(dir=self.store.directory, suffix=".part")
+            self._file = os.fdopen(fd, "wb")
+
+        self.digest.update(chunk)
+        self.size += len(chunk)
+        if len(self.preview) < BODY_PREVIEW_BYTES:
+            self.preview += chunk[:BODY_PREVIEW_BYTES - len(self.preview)]
+        await asyncio.to_thread(self._file.write, chunk)
+
+    async def close(self) -> str:
+        sha = self.digest.hexdigest()
+        if self._file is not None:
+            self._file.close()
+            await asyncio.to_thread(self.store.commit, self._tmp, sha)  # type: ignore
+        return sha
+
+    def discard(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        if self._tmp:
+            try:
+                os.unlink(self._tmp)
+            except OSError:
+                pass
+
+
+class BodyStore:
+    """
+    Content-addressed store for large and binary request bodies: <dir>/<sha[:2]>/<sha>.
+    Identical uploads are stored once. Once the files add up to more than `max_bytes`, the least
+    recently uploaded ones are deleted; interactions keep their hash, size and preview.
+    Every worker counts what it commits on top of its last scan of the directory, and rescans
+    at least every `scan_interval` seconds to pick up what the other workers wrote.
+    """
+
+    def __init__(
+        self,
+        directory: Path = BODY_STORE_DIR,
+        max_bytes: int = BODY_STORE_MAX_BYTES,
+        scan_interval: float = BODY_STORE_SCAN_INTERVAL,
+    ):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.scan_interval = scan_interval
+        self.bytes: int | None = None
+        self._scanned = 0.0
+        self._lock = threading.Lock()
+
+    def path(self, sha: str) -> Path:
+        return self.directory / sha[:2] / sha
+
+    def spool(self) -> SpooledBody:
+        return SpooledBody(self)
+
+    def commit(self, tmp: str, sha: str) -> None:
+        target = self.path(sha)
+        if target.exists():
+            os.unlink(tmp)
+            try:
+                # uploaded again, so it is recent again
+                os.utime(target)
+            except FileNotFoundError:
+                pass
+            return
+        target.parent.mkdir(parents=True, exist_ok=True)
+        size = os.path.getsize(tmp)
+        os.replace(tmp, target)
+
+        with self._lock:
+            if self.bytes is not None:
+                self.bytes += size
+            if self.bytes is None or self.bytes > self.max_bytes or time.monotonic() - self._scanned > self.scan_interval:
+                self.sweep()
+
+    def sweep(self) -> None:
+        """
+        Rescans the directory, drops stale .part files and evicts the oldest bodies down to 90% of max_bytes,
+        so the next few commits do not each trigger another scan.
+        """
+        now = time.time()
+        files: List[Tuple[float, int, Path]] = []
+        for path in self.directory.rglob("*"):
+            try:
+                st = path.stat()
+                if not path.is_file():
+                    continue
+                if path.suffix == ".part":
+                    if now - st.st_mtime > PART_MAX_AGE:
+                        path.unlink()
+                    continue
+            except OSError:
+                # removed by another worker meanwhile
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        if total > self.max_bytes:
+            keep = self.max_bytes * 9 // 10
+            files.sort()
+            evicted = 0
+            for _, size, path in files:
+                if total <= keep:
+                    break
+                try:
+                    path.unlink()
+                    evicted += 1
+                except FileNotFoundError:
+                    pass
+                total -= size
+            print(f"[bodies] Evicted {evicted} bodies, {total} bytes kept")
+
+        self.bytes = total
+        self._scanned = time.monotonic()
+
+
+def body_ref(sha: str, size: int, preview: bytes, content_type: str | None, truncated: bool) -> Dict[str, Any]:
+    """
+    What the request model carries instead of a spooled body: its address plus a bounded preview.
+    """
+    ref: Dict[str, Any] = {
+        "_sha256": sha,
+        "_size": size,
+        "_preview": preview.decode("utf-8", errors="replace"),
+    }
+    if content_type:
+        ref["_content_type"] = content_type
+    if truncated:
+        ref["_truncated"] = True
+    return ref
+
+
+body_store = BodyStore()
@@ -0,0 +1,94 @@
+import time
+
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Set, Tuple
+
+from app.variables import RESPONSE_CACHE_MAX_ITEMS, RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TTL
+
+
+class LRUCache:
+    """
+    Bounded in-memory LRU cache with TTL, byte-size accounting and tag based invalidation.
+    """
+
+    def __init__(self, max_items: int, max_bytes: int, ttl: float):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: OrderedDict[str, Tuple[float, int, Hashable | None, Any]] = OrderedDict()
+        self._tags: Dict[Hashable, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+
+        expires, _, _, value = item
+        if expires < time.monotonic():
+            self.delete(key)
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any, size: int = 0, tag: Hashable | None = None) -> None:
+        if size > self.max_bytes:
+            return
+
+        self.delete(key)
+        self._data[key] = (time.monotonic() + self.ttl, size, tag, value)
+        self.bytes += size
+
+        if tag is not None:
+            self._tags.setdefault(tag, set()).add(key)
+
+        while self._data and (len(self._data) > self.max_items or self.bytes > self.max_bytes):
+            oldest = next(iter(self._data))
+            self.delete(oldest)
+            self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        item = self._data.pop(key, None)
+        if item is None:
+            return
+
+        _, size, tag, _ = item
+        self.bytes -= size
+
+        if tag is not None:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def invalidate_tag(self, tag: Hashable) -> None:
+        for key in list(self._tags.get(tag, ())):
+            self.delete(key)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._tags.clear()
+        self.bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "items": len(self._data),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+resource_cache = LRUCache(RESPONSE_CACHE_MAX_ITEMS, RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TTL)
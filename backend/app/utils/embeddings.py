@@ -0,0 +1,144 @@
+import asyncio
+import hashlib
+import numpy as np
+
+from typing import Any, Dict, List, Set
+
+from app.utils.cache import LRUCache
+from app.utils.llm import embed_batch
+from app.utils.metrics import metrics, timed
+from app.utils.rate_limit import embed_limiter
+from app.variables import EMBED_MODEL, EMBED_CACHE_MAX_ITEMS, EMBED_CACHE_TTL, EMBED_CACHE_REDIS_TTL, \
+    EMBED_BATCH_WINDOW_MS, EMBED_BATCH_MAX
+
+
+class EmbeddingBatcher:
+    """
+    Collects texts for a short window (or until max_batch) and embeds them
+    in a single /api/embed call, resolving every waiting coroutine.
+    """
+
+    def __init__(self, window_ms: float = EMBED_BATCH_WINDOW_MS, max_batch: int = EMBED_BATCH_MAX):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._pending: Dict[str, asyncio.Future] = {}  # type: ignore
+        self._inflight: Dict[str, asyncio.Future] = {}  # type: ignore
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: Set[asyncio.Task] = set()  # type: ignore
+
+    async def embed(self, text: str) -> List[float]:
+        fut = self._pending.get(text) or self._inflight.get(text)
+        if fut is None:
+            loop = asyncio.get_running_loop()
+            fut = loop.create_future()
+            self._pending[text] = fut
+
+            if len(self._pending) >= self.max_batch:
+                self._flush()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.window, self._flush)
+
+        return await asyncio.shield(fut)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, {}
+        if not batch:
+            return
+
+        self._inflight.update(batch)
+
+        task = asyncio.create_task(self._send(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: Dict[str, asyncio.Future]) -> None:  # type: ignore
+        texts = list(batch)
+
+        try:
+            embeddings = await embed_batch(texts)
+        except Exception as e:
+            self._release(batch)
+            print(f"[embed] Batch of {len(texts)} failed: {e}")
+            for fut in batch.values():
+                if not fut.done():
+                    fut.set_exception(e)
+                    # mark as retrieved, callers that are still waiting get it anyway
+                    fut.exception()
+            return
+
+        self._release(batch)
+        for text, embedding in zip(texts, embeddings):
+            fut = batch[text]
+            if not fut.done():
+                fut.set_result(embedding)
+
+    def _release(self, batch: Dict[str, asyncio.Future]) -> None:  # type: ignore
+        for text, fut in batch.items():
+            if self._inflight.get(text) is fut:
+                del self._inflight[text]
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache: in-process LRU first, then float32 blobs in Redis
+    shared by all workers, then Ollama.
+    """
+
+    def __init__(self, max_items: int = EMBED_CACHE_MAX_ITEMS, ttl: float = EMBED_CACHE_TTL, redis_ttl: int = EMBED_CACHE_REDIS_TTL):
+        self.batcher = EmbeddingBatcher()
+        self.local = LRUCache(max_items, max_items * 768 * 4, ttl)
+        self.redis_ttl = redis_ttl
+
+    @staticmethod
+    def key(text: str, model: str = EMBED_MODEL) -> str:
+        digest = hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+        return f"emb:{digest}"
+
+    @timed("embed")
+    async def embed(self, redis: Any, text: str, client_ip: str | None = None) -> List[float] | None:
+        """
+        With `client_ip`, misses that would reach Ollama are rate limited and return None when over the limit.
+        """
+        key = self.key(text)
+
+        cached = self.local.get(key)
+        if cached is not None:
+            metrics.inc("honeypot_embedding_total", tier="memory")
+            return cached
+
+        raw = None
+        try:
+            raw = await redis.get(key)
+        except Exception as e:
+            print(f"[embed] Redis lookup failed: {e}")
+
+        if raw:
+            metrics.inc("honeypot_embedding_total", tier="redis")
+            embedding = np.frombuffer(raw, dtype=np.float32).tolist()
+            self.local.set(key, embedding, len(raw))
+            return embedding
+
+        if client_ip is not None:
+            limited, _ = await embed_limiter.hit(redis, client_ip)
+            if limited:
+                metrics.inc("honeypot_embedding_total", tier="rate_limited")
+                return None
+
+        metrics.inc("honeypot_embedding_total", tier="backend")
+        embedding = await self.batcher.embed(text)
+        blob = np.asarray(embedding, dtype=np.float32).tobytes()
+        self.local.set(key, embedding, len(blob))
+
+        try:
+            await redis.set(key, blob, ex=self.redis_ttl)
+        except Exception as e:
+            print(f"[embed] Redis store failed: {e}")
+
+        return embedding
+
+
+embedding_cache = EmbeddingCache()
@@ -1,113 +1,328 @@
-from typing import Any, Dict, List
+import asyncio
+import time
+
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Tuple, TypeVar
 import httpx
 import orjson
 
 from app.models.llm import LLMResponse
 from app.utils.attack_detector import detect_attack
-from app.variables import OLLAMA_URL, MODEL, OPEN_API_MODEL, SYSTEM_PROMPT, AUGMENT_TEMPLATE, OPEN_API_KEY
+from app.utils.metrics import timed
+from app.utils.prompts import request_fields
+from app.utils.templates import Templates, template_registry
+from app.variables import OLLAMA_URLS, OLLAMA_EMBED_URLS, OPEN_API_URLS, LLM_CHAT_BACKENDS, MODEL, OPEN_API_MODEL, \
+    OPEN_API_KEY, HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE, HTTP_KEEPALIVE_EXPIRY, \
+    HTTP_CONNECT_TIMEOUT, LLM_TIMEOUT, EMBED_TIMEOUT, EMBED_MODEL, LLM_BREAKER_FAILURES, LLM_BREAKER_COOLDOWN, \
+    LLM_HEALTH_INTERVAL, OLLAMA_KEEP_ALIVE
+
+
+T = TypeVar("T")
+
+HEALTH_PATHS = {"ollama": "/api/tags", "openai": "/models"}
+
+
+class NoBackendAvailable(Exception):
+    pass
+
+
+def retryable(e: Exception) -> bool:
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code >= 500 or e.response.status_code == 429
+    return isinstance(e, httpx.TransportError)
+
+
+class Backend:
+    """
+    One LLM endpoint with its own connection pool and circuit breaker.
+    """
+
+    def __init__(self, kind: str, url: str, limits: httpx.Limits):
+        self.kind = kind
+        self.url = url
+        self.outstanding = 0
+        self.served = 0
+        self.failures = 0
+        self.open_until = 0.0
+
+        headers = {"Authorization": f"Bearer {OPEN_API_KEY}", "Content-Type": "application/json"} if kind == "openai" else None
+        self.client = httpx.AsyncClient(
+            base_url=url,
+            http2=kind == "openai",
+            limits=limits,
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            headers=headers,
+        )
+
+    @property
+    def available(self) -> bool:
+        return self.open_until <= time.monotonic()
+
+    def succeeded(self) -> None:
+        if self.open_until:
+            print(f"[llm] Backend {self.url} is back")
+        self.failures = 0
+        self.open_until = 0.0
+
+    def failed(self, error: Exception) -> None:
+        self.failures += 1
+        if self.failures >= LLM_BREAKER_FAILURES:
+            if self.available:
+                print(f"[llm] Backend {self.url} failing, opening circuit for {LLM_BREAKER_COOLDOWN}s: {error!r}")
+            self.open_until = time.monotonic() + LLM_BREAKER_COOLDOWN
+
+    async def check(self) -> None:
+        try:
+            r = await self.client.get(HEALTH_PATHS[self.kind], timeout=HTTP_CONNECT_TIMEOUT)
+            r.raise_for_status()
+        except httpx.HTTPError as e:
+            # an unreachable backend is taken out right away, not after LLM_BREAKER_FAILURES requests
+            self.failures = max(self.failures, LLM_BREAKER_FAILURES - 1)
+            self.failed(e)
+            return
+        self.succeeded()
+
+
+class BackendPool:
+    """
+    Routes each request to the available backend with the fewest requests in flight
+    and fails over to the next one on connection errors and 5xx/429 answers.
+    """
+
+    def __init__(self, name: str, backends: List[Backend]):
+        self.name = name
+        self.backends = backends
+
+    def pick(self, tried: List[Backend]) -> Backend | None:
+        candidates = [b for b in self.backends if b.available and b not in tried]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda b: (b.outstanding, b.served))
+
+    @asynccontextmanager
+    async def use(self, backend: Backend):  # type: ignore
+        backend.outstanding += 1
+        backend.served += 1
+        try:
+            yield backend
+        except httpx.HTTPError as e:
+            if retryable(e):
+                backend.failed(e)
+            raise
+        else:
+            backend.succeeded()
+        finally:
+            backend.outstanding -= 1
+
+    async def request(self, fn: Callable[[Backend], Awaitable[T]]) -> T:
+        tried: List[Backend] = []
+        while True:
+            backend = self.pick(tried)
+            if backend is None:
+                raise NoBackendAvailable(f"No {self.name} backend available")
+            tried.append(backend)
+
+            try:
+                async with self.use(backend):
+                    return await fn(backend)
+            except httpx.HTTPError as e:
+                if not retryable(e) or self.pick(tried) is None:
+                    raise
+                print(f"[llm] {self.name} backend {backend.url} failed, trying another: {e!r}")
+
+
+_pools: Dict[str, BackendPool] = {}
+_backends: Dict[Tuple[str, str], Backend] = {}
+_health: List[asyncio.Task] = []  # type: ignore
+
+
+def init_http_clients() -> None:
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+    def backend(kind: str, url: str) -> Backend:
+        # chat and embed pools pointing at the same box share its connections and breaker
+        if (kind, url) not in _backends:
+            _backends[(kind, url)] = Backend(kind, url, limits)
+        return _backends[(kind, url)]
+
+    urls = {"ollama": OLLAMA_URLS, "openai": OPEN_API_URLS if OPEN_API_KEY else []}
+    _pools["chat"] = BackendPool("chat", [backend(kind, url) for kind in LLM_CHAT_BACKENDS for url in urls.get(kind, [])])
+    _pools["embed"] = BackendPool("embed", [backend("ollama", url) for url in OLLAMA_EMBED_URLS])
+
+    try:
+        _health.append(asyncio.get_running_loop().create_task(health_loop()))
+    except RuntimeError:
+        pass
+
+
+async def health_loop() -> None:
+    while True:
+        await asyncio.sleep(LLM_HEALTH_INTERVAL)
+        await asyncio.gather(*(b.check() for b in list(_backends.values())), return_exceptions=True)
+
 
+async def close_http_clients() -> None:
+    for task in _health:
+        task.cancel()
+    _health.clear()
+    for backend in _backends.values():
+        await backend.client.aclose()
+    _backends.clear()
+    _pools.clear()
 
-async def call_llm(headers: dict, method: str, path: str, body: dict | None, query_params: dict | None) -> LLMResponse:  # type: ignore
+
+def get_pool(name: str) -> BackendPool:
+    if not _pools:
+        init_http_clients()
+    return _pools[name]
+
+
+def build_prompt(headers: dict, method: str, path: str, body: dict | None, query_params: dict | None, templates: Templates) -> str:  # type: ignore
     # faker_section = generate_faker_context(path)
     # system_prompt_final = SYSTEM_PROMPT + "\n\n" + faker_section
 
-    attack_type, attack_template, dynamic_fields, emulated_files = detect_attack(
-        method, path, query_params, body  # type: ignore
+    attack_type, attack_template, _, _ = detect_attack(
+        method, path, query_params, body, templates.attack_template, templates.matcher  # type: ignore
     )
 
     attack_section = ""
     dynamic_fields_section = ""
     emulated_files_section = ""
-
     if attack_type:
         attack_section = f"""
             ATTACK_TYPE: {attack_type}
             ATTACK_BEHAVIOR:
             {attack_template}
         """
+        # fake secrets and files only go to the model when the request looks like an attack on them
+        dynamic_fields_section = templates.dynamic_fields_section
+        emulated_files_section = templates.emulated_files_section
 
-    if not OPEN_API_KEY:
-        if dynamic_fields:
-            dynamic_fields_section = f"""
-                DYNAMIC_FIELDS (use for realism):
-                {orjson.dumps(dynamic_fields)}
-            """
-
-    if emulated_files:
-        emulated_files_section = f"""
-            EMULATED_FILES (you may leak partial fragments if attack type allows it):
-            {orjson.dumps(emulated_files)}
-        """
-    prompt = AUGMENT_TEMPLATE \
-        .replace("{{method}}", str(method)) \
-        .replace("{{headers}}", str(headers)) \
-        .replace("{{path}}", str(path)) \
-        .replace("{{body}}", str(body)) \
-        .replace("{{query_params}}", str(query_params)) \
-        .replace("{{attack_section}}", attack_section) \
-        .replace("{{dynamic_fields_section}}", dynamic_fields_section) \
-        .replace("{{emulated_files_section}}", emulated_files_section)
-
-    headers: Dict[str, Any] | None = None
-    url = f"{OLLAMA_URL}/api/chat"
-    payload: Dict[str, Any] = {
+    fields = request_fields(headers, method, path, body, query_params)
+    fields["attack_section"] = attack_section
+    fields["dynamic_fields_section"] = dynamic_fields_section
+    fields["emulated_files_section"] = emulated_files_section
+
+    return templates.augment.render(fields)
+
+
+def chat_payload(kind: str, prompt: str, system_prompt: str, stream: bool = False) -> Tuple[str, Dict[str, Any]]:
+    if kind == "openai":
+        return "/chat/completions", {
+            "model": OPEN_API_MODEL,      # pewny, dostępny model
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            "stream": stream
+        }
+
+    # the system prompt is identical for every request, so a warm model reuses its KV cache for that prefix
+    return "/api/chat", {
         "model": MODEL,
         "messages": [
-            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "system", "content": system_prompt},
             {"role": "user", "content": prompt},
         ],
-        "stream": False
+        "stream": stream,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
     }
-    if OPEN_API_KEY:
-        print("open api")
-        url = "https://api.openai.com/v1/chat/completions"
-        payload = {
-            "model": OPEN_API_MODEL,      # pewny, dostępny model
-            "messages": [
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": prompt}
-            ]
-        }
-        headers = {
-            "Authorization": f"Bearer {OPEN_API_KEY}",
-            "Content-Type": "application/json",
-        }
 
-    async with httpx.AsyncClient(timeout=180) as client:
-        r = await client.post(url, json=payload, headers=headers)
+
+def chat_content(kind: str, resp_json: Dict[str, Any]) -> str:
+    if kind == "openai":
+        return resp_json["choices"][0]["message"]["content"]
+    return resp_json["message"]["content"]
+
+
+def stream_delta(kind: str, line: str) -> Tuple[str | None, bool]:
+    """
+    Parses one line of a streamed answer into (content delta, done).
+    """
+    if kind == "openai":
+        if not line.startswith("data:"):
+            return None, False
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return None, True
+        choices = orjson.loads(data).get("choices") or [{}]
+        return (choices[0].get("delta") or {}).get("content"), False
+
+    chunk = orjson.loads(line)
+    return (chunk.get("message") or {}).get("content"), bool(chunk.get("done"))
+
+
+async def chat(prompt: str, system_prompt: str, timeout: float | None = None) -> str:
+    async def send(backend: Backend) -> str:
+        url, payload = chat_payload(backend.kind, prompt, system_prompt)
+        r = await backend.client.post(url, json=payload, timeout=timeout or LLM_TIMEOUT)
         r.raise_for_status()
-        resp_json = r.json()
+        return chat_content(backend.kind, r.json())
+
+    return await get_pool("chat").request(send)
+
 
-    if OPEN_API_KEY:
-        data = resp_json["choices"][0]["message"]["content"]
-    else:
-        data = resp_json["message"]["content"]
+@timed("call_llm")
+async def call_llm(headers: dict, method: str, path: str, body: dict | None, query_params: dict | None, templates: Templates | None = None) -> LLMResponse:  # type: ignore
+    templates = templates or template_registry.current
+    data = await chat(build_prompt(headers, method, path, body, query_params, templates), templates.system_prompt)
     return LLMResponse.model_validate(data)
 
 
-async def embed_text(text: str) -> List[float]:
-    async with httpx.AsyncClient(timeout=30) as client:
-        r = await client.post(
-            f"{OLLAMA_URL}/api/embeddings",
-            json={"model": "nomic-embed-text", "prompt": text},
-        )
-        return r.json()["embedding"]
-
-
-async def call_ollama(prompt: str) -> str:
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        resp = await client.post(
-            f"{OLLAMA_URL}/api/chat",
-            json={
-                "model": MODEL,
-                "messages": [
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": prompt},
-                ],
-                "stream": False,
-            },
+async def stream_llm(headers: dict, method: str, path: str, body: dict | None, query_params: dict | None, templates: Templates | None = None) -> AsyncIterator[str]:  # type: ignore
+    """
+    Yields content deltas as the model produces them (Ollama NDJSON or OpenAI SSE).
+    Fails over to another backend only until the first delta has been yielded.
+    """
+    templates = templates or template_registry.current
+    prompt = build_prompt(headers, method, path, body, query_params, templates)
+    pool = get_pool("chat")
+    tried: List[Backend] = []
+
+    while True:
+        backend = pool.pick(tried)
+        if backend is None:
+            raise NoBackendAvailable("No chat backend available")
+        tried.append(backend)
+
+        url, payload = chat_payload(backend.kind, prompt, templates.system_prompt, stream=True)
+        started = False
+        try:
+            async with pool.use(backend), backend.client.stream("POST", url, json=payload) as r:
+                r.raise_for_status()
+                async for line in r.aiter_lines():
+                    if not line:
+                        continue
+                    delta, done = stream_delta(backend.kind, line)
+                    if delta:
+                        started = True
+                        yield delta
+                    if done:
+                        break
+            return
+        except httpx.HTTPError as e:
+            if started or not retryable(e) or pool.pick(tried) is None:
+                raise
+            print(f"[llm] chat backend {backend.url} failed, trying another: {e!r}")
+
+
+@timed("embed_batch")
+async def embed_batch(texts: List[str]) -> List[List[float]]:
+    async def send(backend: Backend) -> List[List[float]]:
+        r = await backend.client.post(
+            "/api/embed",
+            json={"model": EMBED_MODEL, "input": texts, "keep_alive": OLLAMA_KEEP_ALIVE},
+            timeout=httpx.Timeout(EMBED_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
         )
-        resp.raise_for_status()
-        resp_json = resp.json()
-        data = resp_json["message"]["content"]
-        return data
+        r.raise_for_status()
+        return r.json()["embeddings"]
+
+    embeddings = await get_pool("embed").request(send)
+    if len(embeddings) != len(texts):
+        raise ValueError(f"Expected {len(texts)} embeddings, got {len(embeddings)}")
+    return embeddings
+
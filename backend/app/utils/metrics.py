@@ -0,0 +1,227 @@
+import asyncio
+import functools
+import os
+import time
+
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+from app.variables import METRICS_HOST, METRICS_PORT, METRICS_FLUSH_INTERVAL
+
+
+METRICS_KEY = "metrics:counters"
+GAUGES_KEY = "metrics:gauges:"
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# name -> (type, help)
+FAMILIES: Dict[str, Tuple[str, str]] = {
+    "honeypot_stage_seconds": ("histogram", "Time spent in each stage of the request pipeline."),
+    "honeypot_lookup_total": ("counter", "Resource lookups by the tier that answered them."),
+    "honeypot_embedding_total": ("counter", "Embedding lookups by the cache tier that answered them."),
+    "honeypot_rate_limited_total": ("counter", "Requests refused by a rate limiter."),
+    "honeypot_llm_parse_failures_total": ("counter", "Model answers that were not the expected JSON envelope."),
+    "honeypot_llm_skipped_total": ("counter", "Generations answered with the busy 503 instead, by the reason they were skipped."),
+    "honeypot_llm_running": ("gauge", "Generations running in a worker."),
+    "honeypot_llm_waiting": ("gauge", "Generations queued in a worker."),
+    "honeypot_interactions_queued": ("gauge", "Interactions waiting to be written in a worker."),
+}
+
+
+def labels(**kwargs: Any) -> str:
+    if not kwargs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in kwargs.items()) + "}"
+
+
+def fmt(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metrics:
+    """
+    Counters and histograms kept in-process and added up in a Redis hash every
+    METRICS_FLUSH_INTERVAL seconds, so the numbers cover every worker.
+    One worker binds METRICS_PORT and serves /metrics in the Prometheus text format,
+    the others keep retrying the bind in case it goes away.
+    Nothing here is reachable through the honeypot port.
+    """
+
+    def __init__(self, host: str = METRICS_HOST, port: int = METRICS_PORT, interval: float = METRICS_FLUSH_INTERVAL):
+        self.host = host
+        self.port = port
+        self.interval = interval
+        self._pending: Dict[str, float] = defaultdict(float)
+        self._gauges: Dict[str, Callable[[], float]] = {}
+        self._redis: Any = None
+        self._server: asyncio.AbstractServer | None = None
+        self._task: asyncio.Task | None = None  # type: ignore
+
+    def inc(self, name: str, value: float = 1, **label: Any) -> None:
+        self._pending[name + labels(**label)] += value
+
+    def observe(self, stage: str, seconds: float) -> None:
+        pending = self._pending
+        for le in BUCKETS:
+            # every bucket is written, empty ones included, so the series is complete from the first scrape
+            pending[f'honeypot_stage_seconds_bucket{{stage="{stage}",le="{le}"}}'] += seconds <= le
+        pending[f'honeypot_stage_seconds_bucket{{stage="{stage}",le="+Inf"}}'] += 1
+        pending[f'honeypot_stage_seconds_sum{{stage="{stage}"}}'] += seconds
+        pending[f'honeypot_stage_seconds_count{{stage="{stage}"}}'] += 1
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def gauge(self, name: str, read: Callable[[], float]) -> None:
+        self._gauges[name] = read
+
+    async def start(self, redis: Any) -> None:
+        if self.port <= 0 or self._task is not None:
+            return
+        self._redis = redis
+        await self._bind()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+        if self._redis is not None:
+            await self.flush()
+            self._redis = None
+
+    def take(self) -> Dict[str, float]:
+        """
+        Returns the deltas gathered since the last flush and starts over.
+        """
+        pending, self._pending = self._pending, defaultdict(float)
+        return pending
+
+    async def flush(self) -> None:
+        if self._redis is None:
+            return
+        pending = self.take()
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                for field, value in pending.items():
+                    pipe.hincrbyfloat(METRICS_KEY, field, value)
+                if self._gauges:
+                    key = f"{GAUGES_KEY}{os.getpid()}"
+                    pipe.hset(key, mapping={name: read() for name, read in self._gauges.items()})
+                    pipe.expire(key, int(self.interval * 3) + 1)
+                await pipe.execute()
+        except Exception as e:
+            # keep the deltas for the next round
+            for field, value in pending.items():
+                self._pending[field] += value
+            print(f"[metrics] Flush failed: {e}")
+
+    async def render(self) -> str:
+        await self.flush()
+        counters = {k.decode() if isinstance(k, bytes) else k: float(v) for k, v in (await self._redis.hgetall(METRICS_KEY)).items()}
+
+        gauges: List[Tuple[str, float]] = []
+        async for key in self._redis.scan_iter(match=f"{GAUGES_KEY}*"):
+            key = key.decode() if isinstance(key, bytes) else key
+            worker = key[len(GAUGES_KEY):]
+            for name, value in (await self._redis.hgetall(key)).items():
+                name = name.decode() if isinstance(name, bytes) else name
+                gauges.append((name + labels(worker=worker), float(value)))
+
+        lines = []
+        for family, (kind, help_text) in FAMILIES.items():
+            series = gauges if kind == "gauge" else counters.items()
+            # exact family match, so honeypot_llm_running never picks up another family with the same prefix
+            rows = [(k, v) for k, v in series if k.split("{", 1)[0] in (family, f"{family}_bucket", f"{family}_sum", f"{family}_count")]
+            if not rows:
+                continue
+            lines.append(f"# HELP {family} {help_text}")
+            lines.append(f"# TYPE {family} {kind}")
+            lines.extend(f"{k} {fmt(v)}" for k, v in sorted(rows, key=self._order))
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _order(row: Tuple[str, float]) -> Tuple[str, str, float]:
+        # buckets of one stage in ascending le, then _count and _sum
+        name, _ = row
+        base, _, rest = name.partition("{")
+        le = float("inf")
+        if 'le="' in rest:
+            value = rest.split('le="', 1)[1].split('"', 1)[0]
+            le = float("inf") if value == "+Inf" else float(value)
+            rest = rest.split(',le="', 1)[0]
+        return rest, base, le
+
+    async def _bind(self) -> None:
+        if self._server is not None:
+            return
+        try:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+            print(f"[metrics] Serving on {self.host}:{self.port}")
+        except OSError:
+            # another worker has the port
+            self._server = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+            await self._bind()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=5)
+            parts = head.split(b" ", 2)
+            if len(parts) > 1 and parts[0] == b"GET" and parts[1].split(b"?")[0] == b"/metrics":
+                status, body = "200 OK", (await self.render()).encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except Exception as e:
+            print(f"[metrics] Request failed: {e}")
+        finally:
+            writer.close()
+
+
+def timed(stage: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """
+    Records every call of the decorated function (sync or async) as a `stage` span.
+    """
+    def decorator(fn: Callable[..., Any]) -> Callable[..., Any]:
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args: Any, **kwargs: Any) -> Any:
+                with metrics.span(stage):
+                    return await fn(*args, **kwargs)
+            return wrapper
+
+        @functools.wraps(fn)
+        def sync_wrapper(*args: Any, **kwargs: Any) -> Any:
+            with metrics.span(stage):
+                return fn(*args, **kwargs)
+        return sync_wrapper
+
+    return decorator
+
+
+metrics = Metrics()
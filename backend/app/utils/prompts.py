@@ -0,0 +1,86 @@
+import re
+import orjson
+
+from typing import Any, Dict, List
+
+from app.variables import PROMPT_TOKEN_BUDGET, PROMPT_CHARS_PER_TOKEN, PROMPT_HEADER_VALUE_MAX
+
+
+PLACEHOLDER_RE = re.compile(r"\{\{(\w+)\}\}")
+
+
+class PromptTemplate:
+    """
+    A prompt parsed once into literal segments and {{placeholders}}, rendered with a single join.
+    Placeholders without a value are left as they are.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        # even indexes are literal text, odd indexes placeholder names
+        self.parts: List[str] = PLACEHOLDER_RE.split(text)
+        self.fields = set(self.parts[1::2])
+
+    def render(self, values: Dict[str, str]) -> str:
+        parts = self.parts[:]
+        for i in range(1, len(parts), 2):
+            value = values.get(parts[i])
+            parts[i] = "{{" + parts[i] + "}}" if value is None else value
+        return "".join(parts)
+
+
+def compact(value: Any) -> str:
+    if isinstance(value, str):
+        return value
+    if value is None:
+        return "None"
+    try:
+        return orjson.dumps(value).decode()
+    except TypeError:
+        return str(value)
+
+
+def truncate(text: str, limit: int) -> str:
+    if len(text) <= limit:
+        return text
+    marker = f"...[truncated {len(text) - limit} chars]"
+    return text[:max(0, limit - len(marker))] + marker
+
+
+def normalize_headers(headers: Dict[str, Any] | None) -> str:
+    if not headers:
+        return "{}"
+    return compact({k: truncate(str(v), PROMPT_HEADER_VALUE_MAX) for k, v in headers.items()})
+
+
+def fit_budget(values: Dict[str, str], budget: int) -> Dict[str, str]:
+    """
+    Shares `budget` characters between the fields: short fields are kept whole
+    and what they leave over goes to the long ones, so one huge body cannot crowd out the rest.
+    """
+    fitted = {}
+    remaining = budget
+    order = sorted(values, key=lambda k: len(values[k]))
+    for i, key in enumerate(order):
+        share = remaining // (len(order) - i)
+        fitted[key] = truncate(values[key], share)
+        remaining -= len(fitted[key])
+    return fitted
+
+
+def request_fields(
+    headers: Dict[str, Any] | None,
+    method: str,
+    path: str,
+    body: Dict[str, Any] | None,
+    query_params: Dict[str, Any] | None,
+    budget_tokens: int = PROMPT_TOKEN_BUDGET,
+) -> Dict[str, str]:
+    fields = fit_budget({
+        "path": str(path),
+        "headers": normalize_headers(headers),
+        "body": compact(body),
+        "query_params": compact(query_params),
+    }, budget_tokens * PROMPT_CHARS_PER_TOKEN)
+    fields["method"] = str(method)
+    return fields
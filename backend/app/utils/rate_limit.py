@@ -0,0 +1,157 @@
+import ipaddress
+import time
+
+from typing import Any, Dict, Tuple
+
+from app.utils.metrics import metrics
+from app.variables import RATE_MISS_LIMIT, RATE_MISS_SUBNET_LIMIT, RATE_MISS_WINDOW, RATE_LOGIN_LIMIT, \
+    RATE_LOGIN_SUBNET_LIMIT, RATE_LOGIN_WINDOW, RATE_EMBED_LIMIT, RATE_EMBED_SUBNET_LIMIT, RATE_EMBED_WINDOW, \
+    RATE_LEASE_DIVISOR, RATE_LEASE_MIN, RATE_LOCAL_MAX_KEYS
+
+
+# Sliding window counter over two fixed buckets, checked and incremented atomically for every key.
+# KEYS: bucket prefixes, ARGV: now_ms, window_ms, cost, one limit per key.
+# Returns 0 when allowed, otherwise the milliseconds until the current bucket rolls over.
+SLIDING_WINDOW_LUA = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local current = math.floor(now / window)
+local weight = 1 - (now % window) / window
+local retry = 0
+
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[3 + i])
+    local cur = tonumber(redis.call('GET', key .. ':' .. current) or '0')
+    local prev = tonumber(redis.call('GET', key .. ':' .. (current - 1)) or '0')
+    if prev * weight + cur + cost > limit then
+        retry = window - (now % window)
+    end
+end
+
+if retry > 0 then
+    return retry
+end
+
+for _, key in ipairs(KEYS) do
+    local bucket = key .. ':' .. current
+    redis.call('INCRBY', bucket, cost)
+    redis.call('PEXPIRE', bucket, window * 2)
+end
+return 0
+"""
+
+
+def subnet_of(client_ip: str) -> str | None:
+    try:
+        ip = ipaddress.ip_address(client_ip)
+    except ValueError:
+        return None
+    prefix = 24 if ip.version == 4 else 64
+    return str(ipaddress.ip_network(f"{ip}/{prefix}", strict=False))
+
+
+class RateLimiter:
+    """
+    Per client IP and per subnet sliding-window limit shared by all workers through one Lua call.
+    Two local shortcuts keep Redis off the hot path:
+    - a worker leases several tokens at once and spends them without asking Redis again,
+    - a client Redis has refused is refused locally until its window rolls over.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        limit: int,
+        subnet_limit: int,
+        window: int,
+        lease_divisor: int = RATE_LEASE_DIVISOR,
+        lease_min: int = RATE_LEASE_MIN,
+    ):
+        self.name = name
+        self.limit = limit
+        self.subnet_limit = subnet_limit
+        self.window = window
+        smallest = min(limit, subnet_limit)
+        # a lease of a token or two would send nearly every request to Redis anyway
+        self.lease = max(lease_min, smallest // max(1, lease_divisor)) if smallest >= lease_min else 1
+        self._script: Any = None
+        self._leases: Dict[str, Tuple[int, int]] = {}
+        self._blocked: Dict[str, float] = {}
+
+    def script(self, redis: Any) -> Any:
+        if self._script is None or self._script.registered_client is not redis:
+            self._script = redis.register_script(SLIDING_WINDOW_LUA)
+        return self._script
+
+    async def hit(self, redis: Any, client_ip: str | None) -> Tuple[bool, int | None]:
+        """
+        Returns (limited, retry_after_seconds).
+        """
+        client = client_ip or "-"
+        now = time.time()
+        bucket = int(now // self.window)
+
+        until = self._blocked.get(client)
+        if until is not None:
+            if until > now:
+                metrics.inc("honeypot_rate_limited_total", limiter=self.name, source="local")
+                return True, int(until - now) + 1
+            del self._blocked[client]
+
+        if self._spend(client, bucket):
+            return False, None
+
+        retry_ms = await self._take(redis, client, now, self.lease)
+        if retry_ms and self.lease > 1:
+            # close to the limit, fall back to single tokens
+            retry_ms = await self._take(redis, client, now, 1)
+            granted = 1
+        else:
+            granted = self.lease
+
+        if retry_ms:
+            # a concurrent request of the same client may have leased tokens meanwhile
+            if self._spend(client, bucket):
+                return False, None
+            metrics.inc("honeypot_rate_limited_total", limiter=self.name, source="redis")
+            self._remember(self._blocked, client, now + retry_ms / 1000)
+            return True, int(retry_ms / 1000) + 1
+
+        # concurrent requests add to the same lease instead of overwriting each other's tokens
+        window, remaining = self._leases.get(client, (bucket, 0))
+        self._remember(self._leases, client, (bucket, (remaining if window == bucket else 0) + granted - 1))
+        return False, None
+
+    def _spend(self, client: str, bucket: int) -> bool:
+        window, remaining = self._leases.get(client, (bucket, 0))
+        if window != bucket or remaining <= 0:
+            return False
+        self._leases[client] = (bucket, remaining - 1)
+        return True
+
+    async def _take(self, redis: Any, client: str, now: float, cost: int) -> int:
+        keys = [f"rate:{self.name}:ip:{client}"]
+        limits = [self.limit]
+        subnet = subnet_of(client)
+        if subnet:
+            keys.append(f"rate:{self.name}:net:{subnet}")
+            limits.append(self.subnet_limit)
+
+        try:
+            return int(await self.script(redis)(keys=keys, args=[int(now * 1000), self.window * 1000, cost, *limits]))
+        except Exception as e:
+            # fail open, a Redis hiccup should not turn the honeypot off
+            print(f"[rate] {self.name} check failed: {e}")
+            return 0
+
+    @staticmethod
+    def _remember(store: Dict[str, Any], key: str, value: Any) -> None:
+        if key not in store and len(store) >= RATE_LOCAL_MAX_KEYS:
+            store.pop(next(iter(store)))
+        store[key] = value
+
+
+miss_limiter = RateLimiter("miss", RATE_MISS_LIMIT, RATE_MISS_SUBNET_LIMIT, RATE_MISS_WINDOW)
+login_limiter = RateLimiter("login", RATE_LOGIN_LIMIT, RATE_LOGIN_SUBNET_LIMIT, RATE_LOGIN_WINDOW)
+embed_limiter = RateLimiter("embed", RATE_EMBED_LIMIT, RATE_EMBED_SUBNET_LIMIT, RATE_EMBED_WINDOW)
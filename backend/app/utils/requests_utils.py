@@ -1,27 +1,120 @@
-import base64
-from typing import Dict
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict
+from urllib.parse import unquote
 from fastapi import Request
 import json
 
+from app.utils.body_store import body_store, body_ref
+from app.variables import BODY_INLINE_MAX, BODY_MAX_BYTES
 
-async def extract_body_any(request: Request) -> Dict[str, str] | None:
-    raw = await request.body()
 
-    if not raw:
-        return None
+async def extract_body_any(request: Request) -> Dict[str, Any] | None:
+    """
+    Streams the body in. Small JSON/text bodies are parsed inline as before, anything larger
+    than BODY_INLINE_MAX or binary is spooled to the body store (capped at BODY_MAX_BYTES)
+    and replaced by its hash, size and a bounded preview.
+    """
+    buffered = bytearray()
+    spooled = None
+    truncated = False
 
     try:
-        return json.loads(raw)
-    except Exception:
-        pass
+        async for chunk in request.stream():
+            if not chunk:
+                continue
 
-    try:
-        text = raw.decode("utf-8")
-        return {"_text": text}
-    except Exception:
-        pass
-
-    return {
-        "_binary_base64": base64.b64encode(raw).decode("ascii"),
-        "_size": len(raw)  # type: ignore
-    }  # type: ignore
+            if spooled is None:
+                if len(buffered) + len(chunk) <= BODY_INLINE_MAX:
+                    buffered += chunk
+                    continue
+                spooled = body_store.spool()
+                if buffered:
+                    await spooled.write(bytes(buffered))
+                    buffered = bytearray()
+
+            room = BODY_MAX_BYTES - spooled.size
+            if len(chunk) > room:
+                chunk = chunk[:max(room, 0)]
+                truncated = True
+            if chunk:
+                await spooled.write(chunk)
+            if truncated:
+                break
+    except BaseException:
+        if spooled is not None:
+            spooled.discard()
+        raise
+
+    raw = bytes(buffered)
+
+    if spooled is None:
+        if not raw:
+            return None
+
+        try:
+            return json.loads(raw)
+        except Exception:
+            pass
+
+        try:
+            text = raw.decode("utf-8")
+            return {"_text": text}
+        except Exception:
+            pass
+
+        # small binary upload, still kept out of the request model
+        spooled = body_store.spool()
+        await spooled.write(raw)
+
+    sha = await spooled.close()
+    return body_ref(sha, spooled.size, spooled.preview, request.headers.get("content-type"), truncated)
+
+
+def accepts_encoding(accept_encoding: str, encoding: str) -> bool:
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        if name.strip() not in (encoding, "*"):
+            continue
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                return float(q[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def url_decode(value: str, rounds: int = 3) -> str:
+    """
+    Undoes nested URL encoding (%252e -> %2e -> .) up to `rounds` times.
+    """
+    for _ in range(rounds):
+        decoded = unquote(value)
+        if decoded == value:
+            break
+        value = decoded
+    return value
+
+
+def not_modified(headers: Dict[str, Any], etag: str, last_modified: str | None) -> bool:
+    """
+    Conditional GET check. If-None-Match wins over If-Modified-Since and uses weak comparison,
+    a tag of any encoded variant (-gzip / -br) matches the resource.
+    """
+    inm = headers.get("if-none-match")
+    if inm is not None:
+        if inm.strip() == "*":
+            return True
+        base = etag.strip('"')
+        tags = {t.strip().removeprefix("W/").strip('"') for t in inm.split(",")}
+        return bool(tags & {base, f"{base}-gzip", f"{base}-br"})
+
+    ims = headers.get("if-modified-since")
+    if ims and last_modified:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(ims)
+        except (TypeError, ValueError):
+            return False
+
+    return False
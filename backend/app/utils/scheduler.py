@@ -0,0 +1,145 @@
+import asyncio
+
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict
+
+from app.utils.metrics import metrics
+from app.variables import LLM_CONCURRENCY, LLM_QUEUE_MAX, LLM_QUEUE_PER_CLIENT, LLM_QUEUE_TIMEOUT
+
+
+INTERACTIVE = 0
+PREFETCH = 1
+
+PRIORITIES = (INTERACTIVE, PREFETCH)
+
+
+class SchedulerFull(Exception):
+    pass
+
+
+class LLMScheduler:
+    """
+    Bounds concurrent generations per process.
+    Waiting jobs are served by priority, and round-robin across client IPs within a priority,
+    so a single flooding client cannot starve everybody else. When the queue is full a lower
+    priority job is evicted to make room, otherwise the new job is rejected with SchedulerFull.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = LLM_CONCURRENCY,
+        max_queue: int = LLM_QUEUE_MAX,
+        max_per_client: int = LLM_QUEUE_PER_CLIENT,
+        queue_timeout: float = LLM_QUEUE_TIMEOUT,
+    ):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_per_client = max_per_client
+        self.queue_timeout = queue_timeout
+        self.running = 0
+        self.waiting = 0
+        self._per_client: Dict[str, int] = {}
+        self._queues: Dict[int, OrderedDict[str, Deque[asyncio.Future]]] = {p: OrderedDict() for p in PRIORITIES}  # type: ignore
+
+    @asynccontextmanager
+    async def slot(self, client: str | None, priority: int = INTERACTIVE, timeout: float | None = None):  # type: ignore
+        client = client or "-"
+        await self.acquire(client, priority, self.queue_timeout if timeout is None else timeout)
+        try:
+            yield
+        finally:
+            self.release(client)
+
+    async def acquire(self, client: str, priority: int, timeout: float) -> None:
+        if self._per_client.get(client, 0) >= self.max_per_client:
+            raise SchedulerFull(f"client {client} already has {self.max_per_client} generations queued")
+
+        if self.running < self.concurrency and not self.waiting:
+            self._track(client, 1)
+            self.running += 1
+            return
+
+        if self.waiting >= self.max_queue and not self._evict_below(priority):
+            raise SchedulerFull("generation queue is full")
+
+        fut = asyncio.get_running_loop().create_future()
+        self._queues[priority].setdefault(client, deque()).append(fut)
+        self.waiting += 1
+        self._track(client, 1)
+
+        try:
+            async with asyncio.timeout(timeout):
+                await fut
+        except BaseException as e:
+            if fut.done() and not fut.cancelled() and fut.exception() is None:
+                # slot was granted just as we gave up, pass it on
+                self.release(client)
+            else:
+                self._remove(priority, client, fut)
+                self._track(client, -1)
+            raise
+
+    def release(self, client: str) -> None:
+        self.running -= 1
+        self._track(client, -1)
+
+        while self.running < self.concurrency:
+            fut = self._next()
+            if fut is None:
+                break
+            self.running += 1
+            fut.set_result(True)
+
+    def _track(self, client: str, delta: int) -> None:
+        count = self._per_client.get(client, 0) + delta
+        if count > 0:
+            self._per_client[client] = count
+        else:
+            self._per_client.pop(client, None)
+
+    def _next(self) -> asyncio.Future | None:  # type: ignore
+        for priority in PRIORITIES:
+            clients = self._queues[priority]
+            while clients:
+                client, futures = next(iter(clients.items()))
+                fut = futures.popleft()
+                if futures:
+                    clients.move_to_end(client)
+                else:
+                    del clients[client]
+                self.waiting -= 1
+                if not fut.done():
+                    return fut
+        return None
+
+    def _remove(self, priority: int, client: str, fut: asyncio.Future) -> None:  # type: ignore
+        futures = self._queues[priority].get(client)
+        if not futures or fut not in futures:
+            return
+        futures.remove(fut)
+        if not futures:
+            del self._queues[priority][client]
+        self.waiting -= 1
+
+    def _evict_below(self, priority: int) -> bool:
+        for lower in reversed(PRIORITIES):
+            if lower <= priority:
+                return False
+            clients = self._queues[lower]
+            if not clients:
+                continue
+            client, futures = next(reversed(clients.items()))
+            fut = futures.pop()
+            if not futures:
+                del clients[client]
+            self.waiting -= 1
+            if not fut.done():
+                fut.set_exception(SchedulerFull("evicted by a higher priority generation"))
+            return True
+        return False
+
+
+llm_scheduler = LLMScheduler()
+metrics.gauge("honeypot_llm_running", lambda: llm_scheduler.running)
+metrics.gauge("honeypot_llm_waiting", lambda: llm_scheduler.waiting)
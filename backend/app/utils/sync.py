@@ -0,0 +1,83 @@
+import asyncio
+import os
+import uuid
+import orjson
+import numpy as np
+
+from typing import Any
+
+from app.utils.cache import resource_cache
+from app.utils.vector_index import get_vector_index
+from app.variables import SYNC_CHANNEL
+
+
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+async def publish(redis: Any, event: str, **data: Any) -> None:
+    """
+    Tells the other workers that a resource changed so they can drop cached copies
+    and pick up new embeddings.
+    """
+    try:
+        await redis.publish(SYNC_CHANNEL, orjson.dumps({"worker": WORKER_ID, "event": event, **data}))
+    except Exception as e:
+        print(f"[sync] Publish failed: {e}")
+
+
+class SyncListener:
+    def __init__(self):
+        self._task: asyncio.Task | None = None  # type: ignore
+        self._pubsub: Any = None
+
+    async def start(self, redis: Any, db: Any) -> None:
+        self._pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(SYNC_CHANNEL)
+        self._task = asyncio.create_task(self._run(db))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        if self._pubsub is not None:
+            await self._pubsub.unsubscribe(SYNC_CHANNEL)
+            await self._pubsub.aclose()
+            self._pubsub = None
+
+    async def _run(self, db: Any) -> None:
+        while True:
+            try:
+                async for message in self._pubsub.listen():
+                    await self.handle(db, orjson.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[sync] Listener error: {e}")
+                await asyncio.sleep(1)
+
+    async def handle(self, db: Any, msg: Any) -> None:
+        if msg.get("worker") == WORKER_ID:
+            return
+
+        event = msg.get("event")
+        rid = msg.get("id")
+
+        if event == "updated":
+            resource_cache.invalidate_tag(rid)
+
+        elif event == "created":
+            resource_cache.delete(f"path:{msg.get('path')}")
+            resource_cache.delete(f"canonical:{msg.get('canonical_key')}")
+
+            async with db.execute("SELECT embedding FROM embeddings WHERE rowid = ?", (rid,)) as cur:
+                row = await cur.fetchone()
+            if row and row[0]:
+                get_vector_index().add(rid, np.frombuffer(row[0], dtype=np.float32))
+
+
+sync_listener = SyncListener()
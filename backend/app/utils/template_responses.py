@@ -0,0 +1,92 @@
+import hashlib
+import random
+import re
+
+from typing import Any, Dict, List
+
+from app.models.llm import LLMResponse, default_headers
+from app.utils.requests_utils import url_decode
+from app.utils.templates import Templates, template_registry
+from app.variables import TEMPLATE_FAST_PATH
+
+
+PLACEHOLDER_RE = re.compile(r"\{\{(\w+)\}\}")
+TRAVERSAL = "../"
+
+
+def decode(value: str) -> str:
+    """
+    Undoes (double) URL encoding, backslashes and null byte truncation tricks.
+    """
+    return url_decode(value).replace("\\", "/").split("\x00")[0]
+
+
+def request_values(query_params: Dict[str, Any] | None, body: Dict[str, Any] | None) -> List[str]:
+    values = []
+    for source in (query_params, body):
+        if isinstance(source, dict):
+            values.extend(decode(v) for v in source.values() if isinstance(v, str))
+    return values
+
+
+def match_file(templates: Templates, path: str, query_params: Dict[str, Any] | None, body: Dict[str, Any] | None) -> str | None:
+    """
+    Returns the emulated file a request is unambiguously asking for.
+    Web root dotfiles (/.env, /.git/config) match on the path suffix, system files only
+    when they are the target of a traversal in the path or a parameter value.
+    """
+    path = "/" + decode(path).lstrip("/")
+    values = request_values(query_params, body)
+
+    for name in templates.emulated_files:
+        if name.startswith("/."):
+            if path.endswith(name):
+                return name
+            continue
+
+        if TRAVERSAL in path and path.endswith(name):
+            return name
+        if any(v.endswith(name) and (v.startswith("/") or TRAVERSAL in v) for v in values):
+            return name
+
+    return None
+
+
+def render_file(templates: Templates, name: str, seed: str) -> str:
+    # seeded by the path so every worker renders the same secrets for the same request
+    rng = random.Random(hashlib.sha256(seed.encode()).digest())
+
+    def fill(m: re.Match) -> str:  # type: ignore
+        key = m.group(1)
+        if key == "secret":
+            return "%032x" % rng.getrandbits(128)
+        options = templates.dynamic_fields.get(key)
+        return str(rng.choice(options)) if options else m.group(0)
+
+    return PLACEHOLDER_RE.sub(fill, templates.emulated_files[name])
+
+
+def template_response(
+    method: str,
+    path: str,
+    query_params: Dict[str, Any] | None,
+    body: Dict[str, Any] | None,
+    templates: Templates | None = None,
+) -> LLMResponse | None:
+    """
+    Answers high-confidence file disclosure probes straight from the emulated files.
+    Returns None when the LLM has to handle the request.
+    """
+    if not TEMPLATE_FAST_PATH or method not in ("GET", "POST"):
+        return None
+
+    templates = templates or template_registry.current
+    name = match_file(templates, path, query_params, body)
+    if name is None:
+        return None
+
+    return LLMResponse(
+        body=render_file(templates, name, f"{path}{name}"),
+        status_code=200,
+        headers=default_headers(),
+    )
@@ -0,0 +1,132 @@
+import asyncio
+import hashlib
+import orjson
+
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from app.utils.attack_detector import AttackMatcher
+from app.utils.prompts import PromptTemplate
+from app.variables import PROMPT_DIR, SYSTEM_PROMPT_NAME, AUGMENT_PROMPT_MAME, ATTACK_TEMPLATE_NAME, \
+    TEMPLATE_RELOAD_INTERVAL, OPEN_API_KEY
+
+
+REQUIRED_PLACEHOLDERS = ("method", "path")
+
+
+class Templates:
+    """
+    One validated, immutable set of prompts and attack signatures.
+    The version is a content hash, so every worker derives the same one from the same files.
+    """
+
+    def __init__(self, system_prompt: str, augment_template: str, attack_template: Dict[str, Any]):
+        self.system_prompt = system_prompt
+        self.augment_template = augment_template
+        self.augment = PromptTemplate(augment_template)
+        self.attack_template = attack_template
+        self.matcher = AttackMatcher(attack_template)
+        self.dynamic_fields: Dict[str, List[str]] = attack_template.get("dynamic_fields", {})
+        self.emulated_files: Dict[str, str] = attack_template.get("emulated_files", {}).get("files", {})
+
+        # the same for every request, rendered once per version
+        self.dynamic_fields_section = ""
+        self.emulated_files_section = ""
+        if not OPEN_API_KEY and self.dynamic_fields:
+            self.dynamic_fields_section = f"""
+                DYNAMIC_FIELDS (use for realism):
+                {orjson.dumps(self.dynamic_fields)}
+            """
+        if self.emulated_files:
+            self.emulated_files_section = f"""
+            EMULATED_FILES (you may leak partial fragments if attack type allows it):
+            {orjson.dumps(self.emulated_files)}
+        """
+
+        digest = hashlib.sha256()
+        for part in (system_prompt.encode(), augment_template.encode(), orjson.dumps(attack_template)):
+            digest.update(part)
+        self.version = digest.hexdigest()[:12]
+
+    @classmethod
+    def load(cls, directory: Path = PROMPT_DIR) -> "Templates":
+        system_prompt = (directory / SYSTEM_PROMPT_NAME).read_text(encoding="utf-8")
+        augment_template = (directory / AUGMENT_PROMPT_MAME).read_text(encoding="utf-8")
+        attack_template = orjson.loads((directory / ATTACK_TEMPLATE_NAME).read_bytes())
+
+        if not system_prompt.strip():
+            raise ValueError(f"{SYSTEM_PROMPT_NAME} is empty")
+        fields = PromptTemplate(augment_template).fields
+        for placeholder in REQUIRED_PLACEHOLDERS:
+            if placeholder not in fields:
+                raise ValueError(f"{AUGMENT_PROMPT_MAME} is missing {{{{{placeholder}}}}}")
+        if not isinstance(attack_template, dict):
+            raise ValueError(f"{ATTACK_TEMPLATE_NAME} must be a JSON object")
+        for key, entry in attack_template.items():
+            if isinstance(entry, dict) and "patterns" in entry and not isinstance(entry["patterns"], list):
+                raise ValueError(f"{ATTACK_TEMPLATE_NAME}: {key}.patterns must be a list")
+
+        return cls(system_prompt, augment_template, attack_template)
+
+
+class TemplateRegistry:
+    """
+    Holds the current Templates and swaps in a new set when the files in templates/ change.
+    A set that fails validation is logged and the previous one keeps serving.
+    """
+
+    def __init__(self, directory: Path = PROMPT_DIR, interval: float = TEMPLATE_RELOAD_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self._task: asyncio.Task | None = None  # type: ignore
+        self._stamp = self.stamp()
+        self.current = Templates.load(directory)
+
+    def stamp(self) -> Tuple[Tuple[str, int, int], ...]:
+        stamp = []
+        for name in (SYSTEM_PROMPT_NAME, AUGMENT_PROMPT_MAME, ATTACK_TEMPLATE_NAME):
+            try:
+                st = (self.directory / name).stat()
+                stamp.append((name, st.st_mtime_ns, st.st_size))
+            except OSError:
+                stamp.append((name, 0, 0))
+        return tuple(stamp)
+
+    def reload(self) -> bool:
+        self._stamp = self.stamp()
+        try:
+            templates = Templates.load(self.directory)
+        except Exception as e:
+            print(f"[templates] Keeping version {self.current.version}, reload failed: {e}")
+            return False
+
+        if templates.version == self.current.version:
+            return False
+
+        self.current = templates
+        print(f"[templates] Loaded version {templates.version}")
+        return True
+
+    def start(self) -> None:
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            if self.stamp() != self._stamp:
+                # parsing and building the matcher is CPU work, keep it off the event loop
+                await asyncio.to_thread(self.reload)
+
+
+template_registry = TemplateRegistry()
@@ -0,0 +1,288 @@
+import abc
+import asyncio
+import os
+import numpy as np
+
+from pathlib import Path
+from typing import Any, List, Tuple
+
+from app.variables import DB_PATH, VECTOR_INDEX, VECTOR_DIM, VECTOR_SNAPSHOT_EVERY, VECTOR_SNAPSHOT_LOCK_TTL
+
+
+class VectorIndex(abc.ABC):
+    """
+    In-memory nearest neighbour index over resource embeddings.
+    Scores are cosine similarities, ids are resource ids.
+    """
+
+    suffix = ".index"
+
+    def __init__(self, dim: int = VECTOR_DIM):
+        self.dim = dim
+        self.max_id = 0
+        self.added = 0
+        self.saving = False
+        self._backlog: List[Tuple[int, np.ndarray]] = []
+
+    @abc.abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    def add(self, rid: int, embedding: Any) -> None:
+        vec = self.normalize(embedding)
+        if self.saving:
+            # snapshot is being written from another thread, apply once it is done
+            self._backlog.append((rid, vec))
+            return
+        self._add(rid, vec)
+        self.max_id = max(self.max_id, rid)
+        self.added += 1
+
+    def flush_backlog(self) -> None:
+        backlog, self._backlog = self._backlog, []
+        for rid, vec in backlog:
+            self.add(rid, vec)
+
+    @abc.abstractmethod
+    def _add(self, rid: int, vec: np.ndarray) -> None:
+        ...
+
+    @abc.abstractmethod
+    def search(self, embedding: Any, k: int = 1) -> List[Tuple[int, float]]:
+        ...
+
+    @abc.abstractmethod
+    def save(self, path: Path) -> None:
+        ...
+
+    @abc.abstractmethod
+    def load(self, path: Path) -> None:
+        ...
+
+    def normalize(self, embedding: Any) -> np.ndarray:
+        vec = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        if vec.shape[0] != self.dim:
+            raise ValueError(f"Expected embedding of dim {self.dim}, got {vec.shape[0]}")
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+
+class NumpyIndex(VectorIndex):
+    """
+    Exact search: one normalized float32 matrix, cosine = dot product.
+    """
+
+    suffix = ".npz"
+
+    def __init__(self, dim: int = VECTOR_DIM, capacity: int = 1024):
+        super().__init__(dim)
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _add(self, rid: int, vec: np.ndarray) -> None:
+        if self._size == len(self._ids):
+            capacity = len(self._ids) * 2
+            self._ids = np.resize(self._ids, capacity)
+            vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+            vectors[:self._size] = self._vectors[:self._size]
+            self._vectors = vectors
+
+        self._ids[self._size] = rid
+        self._vectors[self._size] = vec
+        self._size += 1
+
+    def search(self, embedding: Any, k: int = 1) -> List[Tuple[int, float]]:
+        if not self._size:
+            return []
+
+        scores = self._vectors[:self._size] @ self.normalize(embedding)
+        k = min(k, self._size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(self._ids[i]), float(scores[i])) for i in top]
+
+    def save(self, path: Path) -> None:
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, ids=self._ids[:self._size], vectors=self._vectors[:self._size])
+        os.replace(tmp, path)
+
+    def load(self, path: Path) -> None:
+        with np.load(path) as data:
+            ids, vectors = data["ids"], data["vectors"]
+
+        capacity = max(1024, len(ids) * 2)
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        self._ids[:len(ids)] = ids
+        self._vectors[:len(ids)] = vectors
+        self._size = len(ids)
+        self.max_id = int(ids.max()) if len(ids) else 0
+
+
+class HnswIndex(VectorIndex):
+    """
+    Approximate search backed by hnswlib (cosine space).
+    """
+
+    suffix = ".hnsw"
+
+    def __init__(self, dim: int = VECTOR_DIM, capacity: int = 1024, m: int = 16, ef_construction: int = 200, ef: int = 64):
+        import hnswlib  # type: ignore
+
+        super().__init__(dim)
+        self.ef = ef
+        self._hnswlib = hnswlib
+        self._index = hnswlib.Index(space="cosine", dim=dim)
+        self._index.init_index(max_elements=capacity, M=m, ef_construction=ef_construction, allow_replace_deleted=True)
+        self._index.set_ef(ef)
+
+    def __len__(self) -> int:
+        return self._index.get_current_count()
+
+    def _add(self, rid: int, vec: np.ndarray) -> None:
+        if len(self) >= self._index.get_max_elements():
+            self._index.resize_index(self._index.get_max_elements() * 2)
+
+        self._index.add_items(vec.reshape(1, -1), np.asarray([rid]))
+
+    def search(self, embedding: Any, k: int = 1) -> List[Tuple[int, float]]:
+        if not len(self):
+            return []
+
+        k = min(k, len(self))
+        labels, distances = self._index.knn_query(self.normalize(embedding).reshape(1, -1), k=k)
+        return [(int(rid), 1.0 - float(d)) for rid, d in zip(labels[0], distances[0])]
+
+    def save(self, path: Path) -> None:
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        self._index.save_index(str(tmp))
+        os.replace(tmp, path)
+
+    def load(self, path: Path) -> None:
+        self._index = self._hnswlib.Index(space="cosine", dim=self.dim)
+        self._index.load_index(str(path), allow_replace_deleted=True)
+        self._index.set_ef(self.ef)
+        ids = self._index.get_ids_list()
+        self.max_id = int(max(ids)) if ids else 0
+
+
+def create_index(kind: str = VECTOR_INDEX) -> VectorIndex:
+    if kind == "hnsw":
+        try:
+            return HnswIndex()
+        except ImportError:
+            print("[vector] hnswlib not installed, falling back to numpy index")
+    return NumpyIndex()
+
+
+def snapshot_path(index: VectorIndex) -> Path:
+    return Path(str(DB_PATH)).with_suffix(index.suffix)
+
+
+async def load_vector_index(db: Any) -> VectorIndex:
+    index = create_index()
+    path = snapshot_path(index)
+
+    if path.exists():
+        try:
+            await asyncio.to_thread(index.load, path)
+            print(f"[vector] Loaded {len(index)} vectors from {path}")
+        except Exception as e:
+            print(f"[vector] Failed loading snapshot {path}: {e}")
+            index = create_index()
+
+    if len(index):
+        count = await count_embeddings(db, index.max_id)
+        if count is not None and count != len(index):
+            # snapshot written by a worker that had not seen every row yet
+            print("[vector] Snapshot out of date, rebuilding from the embeddings table")
+            index = create_index()
+
+    await refresh_vector_index(db, index)
+    return index
+
+
+async def count_embeddings(db: Any, max_id: int) -> int | None:
+    try:
+        async with db.execute(
+            "SELECT COUNT(*) FROM embeddings WHERE rowid <= ? AND embedding IS NOT NULL", (max_id,)
+        ) as cur:
+            (count,) = await cur.fetchone()
+        return count
+    except Exception as e:
+        print(f"[vector] Failed counting embeddings: {e}")
+        return None
+
+
+async def refresh_vector_index(db: Any, index: VectorIndex) -> int:
+    """
+    Adds embeddings written after the index (or its snapshot) was built.
+    """
+    count = 0
+    try:
+        async with db.execute(
+            "SELECT rowid, embedding FROM embeddings WHERE rowid > ? ORDER BY rowid", (index.max_id,)
+        ) as cur:
+            async for rid, blob in cur:
+                if not blob:
+                    continue
+                index.add(rid, np.frombuffer(blob, dtype=np.float32))
+                count += 1
+    except Exception as e:
+        print(f"[vector] Failed loading embeddings: {e}")
+
+    return count
+
+
+async def save_vector_index(index: VectorIndex) -> None:
+    if index.saving:
+        return
+
+    path = snapshot_path(index)
+    index.saving = True
+    try:
+        await asyncio.to_thread(index.save, path)
+        index.added = 0
+    except Exception as e:
+        print(f"[vector] Failed saving snapshot {path}: {e}")
+    finally:
+        index.saving = False
+        index.flush_backlog()
+
+
+async def add_vector(rid: int, embedding: Any, redis: Any = None) -> None:
+    index = get_vector_index()
+    index.add(rid, embedding)
+    if not VECTOR_SNAPSHOT_EVERY or index.added < VECTOR_SNAPSHOT_EVERY:
+        return
+
+    # with several workers only one of them writes the shared snapshot at a time
+    if redis is not None and not await redis.set("vector:snapshot", os.getpid(), ex=VECTOR_SNAPSHOT_LOCK_TTL, nx=True):
+        index.added = 0
+        return
+
+    await save_vector_index(index)
+
+
+_index: List[VectorIndex] = []
+
+
+async def init_vector_index(db: Any) -> None:
+    _index[:] = [await load_vector_index(db)]
+
+
+async def close_vector_index() -> None:
+    if _index:
+        await save_vector_index(_index[0])
+        _index.clear()
+
+
+def get_vector_index() -> VectorIndex:
+    if not _index:
+        _index.append(create_index())
+    return _index[0]
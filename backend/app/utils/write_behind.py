@@ -0,0 +1,130 @@
+import asyncio
+
+from typing import Any, Awaitable, Callable, Dict, List, Sequence
+
+from app.variables import WRITE_BEHIND_BATCH, WRITE_BEHIND_INTERVAL_MS, WRITE_BEHIND_MAX_QUEUE, WRITE_BEHIND_POLICY
+
+
+class BatchWriter:
+    """
+    Write-behind queue for INSERTs that do not have to be visible before the response is sent.
+    Rows are flushed with executemany in one transaction every `batch_size` rows or `interval_ms`.
+    When the queue is full rows are dropped ("drop") or the caller waits ("block").
+    `on_written` is awaited with every batch once it is committed.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        sql: str,
+        batch_size: int = WRITE_BEHIND_BATCH,
+        interval_ms: float = WRITE_BEHIND_INTERVAL_MS,
+        max_queue: int = WRITE_BEHIND_MAX_QUEUE,
+        policy: str = WRITE_BEHIND_POLICY,
+        on_written: Callable[[List[Sequence[Any]]], Awaitable[None]] | None = None,
+    ):
+        self.name = name
+        self.sql = sql
+        self.batch_size = batch_size
+        self.interval = interval_ms / 1000
+        self.max_queue = max_queue
+        self.policy = policy
+        self.on_written = on_written
+        self.db: Any = None
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue: asyncio.Queue[Sequence[Any]] | None = None
+        self._task: asyncio.Task | None = None  # type: ignore
+        self._writing: asyncio.Task | None = None  # type: ignore
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self, db: Any) -> None:
+        self.db = db
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+        if self._writing is not None:
+            await self._writing
+
+        # flush whatever is still queued
+        while self._queue is not None and not self._queue.empty():
+            await self._write(self._drain([]))
+
+    async def put(self, params: Sequence[Any]) -> bool:
+        if self._queue is None:
+            await self._write([params])
+            return True
+
+        if self.policy == "block":
+            await self._queue.put(params)
+            return True
+
+        try:
+            self._queue.put_nowait(params)
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                print(f"[{self.name}] Write-behind queue full, dropped {self.dropped} rows so far")
+            return False
+
+    async def _run(self) -> None:
+        assert self._queue is not None
+        while True:
+            batch = [await self._queue.get()]
+            if self._queue.qsize() < self.batch_size - 1:
+                try:
+                    await asyncio.sleep(self.interval)
+                except asyncio.CancelledError:
+                    # stopped while collecting, the rows already taken off the queue still get written
+                    await self._write(self._drain(batch))
+                    raise
+
+            # shielded so a shutdown does not abort a half-written transaction
+            self._writing = asyncio.create_task(self._write(self._drain(batch)))
+            await asyncio.shield(self._writing)
+            self._writing = None
+
+    def _drain(self, batch: List[Sequence[Any]]) -> List[Sequence[Any]]:
+        assert self._queue is not None
+        while len(batch) < self.batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _write(self, batch: List[Sequence[Any]]) -> None:
+        if not batch:
+            return
+        try:
+            await self.db.executemany(self.sql, batch)
+            await self.db.commit()
+            self.written += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            print(f"[{self.name}] Failed writing {len(batch)} rows: {e}")
+            return
+
+        if self.on_written is not None:
+            await self.on_written(batch)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
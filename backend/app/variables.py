@@ -2,17 +2,123 @@ import os
 
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict
+from typing import List
 
 
 SECRET = os.getenv("SECRET")
 
 DB_PATH = os.getenv("DB_NAME", Path(f"/volume/{datetime.now().strftime("%Y-%m-%d")}.db"))
+DB_READERS = int(os.getenv("DB_READERS", str(min(4, os.cpu_count() or 1))))
 REDIS_HOST = os.getenv("REDIS_HOST", "honeypot-redis")
 REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
-OLLAMA_URL = os.getenv("OLLAMA_BASE_URLS", "http://localhost:11434")
 OPEN_API_KEY = os.getenv("OPEN_API_KEY", None)
 
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "180"))
+LLM_STREAM = os.getenv("LLM_STREAM", "1") == "1"
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "2"))
+LLM_QUEUE_MAX = int(os.getenv("LLM_QUEUE_MAX", "32"))
+LLM_QUEUE_PER_CLIENT = int(os.getenv("LLM_QUEUE_PER_CLIENT", "4"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "20"))
+# measured from the start of the generation until the response head is known
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", str(LLM_TIMEOUT)))
+LLM_SLOT_POLL = float(os.getenv("LLM_SLOT_POLL", "0.05"))
+TEMPLATE_FAST_PATH = os.getenv("TEMPLATE_FAST_PATH", "1") == "1"
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1024"))
+PROMPT_CHARS_PER_TOKEN = int(os.getenv("PROMPT_CHARS_PER_TOKEN", "4"))
+PROMPT_HEADER_VALUE_MAX = int(os.getenv("PROMPT_HEADER_VALUE_MAX", "256"))
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+EMBED_TIMEOUT = float(os.getenv("EMBED_TIMEOUT", "30"))
+OPEN_API_URL = os.getenv("OPEN_API_URL", "https://api.openai.com/v1")
+
+
+def url_list(value: str) -> List[str]:
+    return [u.strip().rstrip("/") for u in value.split(",") if u.strip()]
+
+
+OLLAMA_URLS = url_list(os.getenv("OLLAMA_BASE_URLS", "http://localhost:11434"))
+OLLAMA_EMBED_URLS = url_list(os.getenv("OLLAMA_EMBED_URLS", "")) or OLLAMA_URLS
+OPEN_API_URLS = url_list(OPEN_API_URL)
+LLM_CHAT_BACKENDS = [k.strip() for k in os.getenv("LLM_CHAT_BACKENDS", "openai" if OPEN_API_KEY else "ollama").split(",") if k.strip()]
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+LLM_HEALTH_INTERVAL = float(os.getenv("LLM_HEALTH_INTERVAL", "15"))
+
+RATE_MISS_LIMIT = int(os.getenv("RATE_MISS_LIMIT", "10"))
+RATE_MISS_SUBNET_LIMIT = int(os.getenv("RATE_MISS_SUBNET_LIMIT", "50"))
+RATE_MISS_WINDOW = int(os.getenv("RATE_MISS_WINDOW", "900"))
+RATE_LOGIN_LIMIT = int(os.getenv("RATE_LOGIN_LIMIT", "30"))
+RATE_LOGIN_SUBNET_LIMIT = int(os.getenv("RATE_LOGIN_SUBNET_LIMIT", "150"))
+RATE_LOGIN_WINDOW = int(os.getenv("RATE_LOGIN_WINDOW", "300"))
+RATE_EMBED_LIMIT = int(os.getenv("RATE_EMBED_LIMIT", "300"))
+RATE_EMBED_SUBNET_LIMIT = int(os.getenv("RATE_EMBED_SUBNET_LIMIT", "1500"))
+RATE_EMBED_WINDOW = int(os.getenv("RATE_EMBED_WINDOW", "60"))
+RATE_LEASE_DIVISOR = int(os.getenv("RATE_LEASE_DIVISOR", "10"))
+# smallest lease worth keeping locally, limits below it are checked in Redis every time
+RATE_LEASE_MIN = int(os.getenv("RATE_LEASE_MIN", "3"))
+RATE_LOCAL_MAX_KEYS = int(os.getenv("RATE_LOCAL_MAX_KEYS", "10000"))
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
+RESPONSE_CACHE_MAX_ITEMS = int(os.getenv("RESPONSE_CACHE_MAX_ITEMS", "10000"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+
+EMBED_MODEL = os.getenv("EMBED_MODEL", "nomic-embed-text")
+EMBED_CACHE_MAX_ITEMS = int(os.getenv("EMBED_CACHE_MAX_ITEMS", "20000"))
+EMBED_CACHE_TTL = float(os.getenv("EMBED_CACHE_TTL", "3600"))
+EMBED_CACHE_REDIS_TTL = int(os.getenv("EMBED_CACHE_REDIS_TTL", "86400"))
+
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "5"))
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", "32"))
+
+VECTOR_INDEX = os.getenv("VECTOR_INDEX", "hnsw")
+VECTOR_DIM = int(os.getenv("VECTOR_DIM", "768"))
+VECTOR_TOP_K = int(os.getenv("VECTOR_TOP_K", "3"))
+VECTOR_SIMILARITY_THRESHOLD = float(os.getenv("VECTOR_SIMILARITY_THRESHOLD", "0.85"))
+VECTOR_SNAPSHOT_EVERY = int(os.getenv("VECTOR_SNAPSHOT_EVERY", "500"))
+VECTOR_SNAPSHOT_LOCK_TTL = int(os.getenv("VECTOR_SNAPSHOT_LOCK_TTL", "60"))
+
+SYNC_CHANNEL = os.getenv("SYNC_CHANNEL", "moloh:sync")
+
+LOGIN_TOKEN_TTL = int(os.getenv("LOGIN_TOKEN_TTL", "9000"))
+LOGIN_BLOOM_CAPACITY = int(os.getenv("LOGIN_BLOOM_CAPACITY", "1000000"))
+LOGIN_BLOOM_ERROR = float(os.getenv("LOGIN_BLOOM_ERROR", "0.001"))
+
+WRITE_BEHIND_BATCH = int(os.getenv("WRITE_BEHIND_BATCH", "500"))
+WRITE_BEHIND_INTERVAL_MS = float(os.getenv("WRITE_BEHIND_INTERVAL_MS", "200"))
+WRITE_BEHIND_MAX_QUEUE = int(os.getenv("WRITE_BEHIND_MAX_QUEUE", "50000"))
+WRITE_BEHIND_POLICY = os.getenv("WRITE_BEHIND_POLICY", "drop")
+
+PREFETCH_WORDLISTS = [p for p in os.getenv("PREFETCH_WORDLISTS", "locust/fuzzing.txt").split(",") if p]
+# JSONL of {"method", "path", "query_params"}, none by default
+PREFETCH_REQUESTS_FILE = os.getenv("PREFETCH_REQUESTS_FILE", "")
+PREFETCH_HISTORY_LIMIT = int(os.getenv("PREFETCH_HISTORY_LIMIT", "500"))
+PREFETCH_BATCH = int(os.getenv("PREFETCH_BATCH", "50"))
+PREFETCH_SEEN_TTL = int(os.getenv("PREFETCH_SEEN_TTL", "86400"))
+PREFETCH_INTERVAL_MINUTES = int(os.getenv("PREFETCH_INTERVAL_MINUTES", "5"))
+
+BODY_INLINE_MAX = int(os.getenv("BODY_INLINE_MAX", str(64 * 1024)))
+BODY_MAX_BYTES = int(os.getenv("BODY_MAX_BYTES", str(32 * 1024 * 1024)))
+BODY_PREVIEW_BYTES = int(os.getenv("BODY_PREVIEW_BYTES", "4096"))
+BODY_STORE_DIR = Path(os.getenv("BODY_STORE_DIR", Path(DB_PATH).parent / "bodies"))
+BODY_STORE_MAX_BYTES = int(os.getenv("BODY_STORE_MAX_BYTES", str(1024 * 1024 * 1024)))
+# how old this worker's view of the store size may get before a commit rescans the directory
+BODY_STORE_SCAN_INTERVAL = float(os.getenv("BODY_STORE_SCAN_INTERVAL", "60"))
+
+GZIP_MIN_SIZE = int(os.getenv("GZIP_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "9"))
+
+SINGLE_FLIGHT_TTL = int(os.getenv("SINGLE_FLIGHT_TTL", "240"))
+SINGLE_FLIGHT_RESULT_TTL = int(os.getenv("SINGLE_FLIGHT_RESULT_TTL", "30"))
+SINGLE_FLIGHT_POLL = float(os.getenv("SINGLE_FLIGHT_POLL", "0.05"))
+
 RESOURCES_SQL = Path("app/sql/resources.sql")
 INTERACTION_SQL = Path("app/sql/interactions.sql")
 USERS_SQL = Path("app/sql/users.sql")
@@ -26,6 +132,21 @@ EXT_VSS = Path("/usr/local/lib/sqlite/vss0.so")
 
 EXTENSIONS = [EXT_VECTOR, EXT_VSS]
 
+MIGRATIONS = {
+    "resources": [
+        ("response_raw", "ALTER TABLE resources ADD COLUMN response_raw BLOB;"),
+        ("response_gzip", "ALTER TABLE resources ADD COLUMN response_gzip BLOB;"),
+        ("media_type", "ALTER TABLE resources ADD COLUMN media_type TEXT;"),
+        ("template_version", "ALTER TABLE resources ADD COLUMN template_version TEXT;"),
+        ("response_br", "ALTER TABLE resources ADD COLUMN response_br BLOB;"),
+        ("etag", "ALTER TABLE resources ADD COLUMN etag TEXT;"),
+    ],
+    "interactions": [
+        ("body_sha256", "ALTER TABLE interactions ADD COLUMN body_sha256 TEXT;"),
+        ("body_size", "ALTER TABLE interactions ADD COLUMN body_size INTEGER;"),
+    ],
+}
+
 PRAGMAS = [
     "PRAGMA foreign_keys=ON;",
     "PRAGMA journal_mode=WAL;",
@@ -41,24 +162,7 @@ OPEN_API_MODEL = os.getenv("OPEN_API_MODEL", "gpt-5-nano")
 
 PROMPT_DIR = Path("templates")
 
-
-def load_prompt(name: str) -> str:
-    path = PROMPT_DIR / name
-    return path.read_text(encoding="utf-8")
-
-
-def load_attack_template(name: str) -> Dict[str, Any] | None:
-    try:
-        with open(PROMPT_DIR / name, "r", encoding="utf-8") as f:  # type: ignore
-            data = orjson.loads(f.read())  # type: ignore
-        return data
-    except:
-        return None
-
-
 SYSTEM_PROMPT_NAME = "mega_system_prompt_template.txt" if OPEN_API_KEY else "small_system_prompt_template.txt"
 AUGMENT_PROMPT_MAME = "mega_prompt_template.txt" if OPEN_API_KEY else "small_prompt_template.txt"
-
-SYSTEM_PROMPT = load_prompt(SYSTEM_PROMPT_NAME)
-AUGMENT_TEMPLATE = load_prompt(AUGMENT_PROMPT_MAME)
-ATTACK_TEMPLATE = load_attack_template("attack_templates.json")
+ATTACK_TEMPLATE_NAME = "attack_templates.json"
+TEMPLATE_RELOAD_INTERVAL = float(os.getenv("TEMPLATE_RELOAD_INTERVAL", "5"))
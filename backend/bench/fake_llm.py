@@ -0,0 +1,148 @@
+"""
+Stand-in for Ollama and OpenAI-compatible backends, run as its own process by bench/run.py.
+
+    python -m bench.fake_llm --port 11555 --latency 200 --token-rate 80
+
+Chat answers are a valid honeypot LLMResponse streamed at `--token-rate` tokens per second
+after `--latency` ms. Embeddings are deterministic and ignore UUIDs and digits,
+so /users/<uuid-a> and /users/<uuid-b> embed identically and produce vector hits.
+"""
+import argparse
+import asyncio
+import hashlib
+import re
+import time
+
+import numpy as np
+import orjson
+import uvicorn
+
+from typing import Any, AsyncIterator, Dict, List
+from fastapi import FastAPI, Request
+from fastapi.responses import Response, StreamingResponse
+
+
+CHARS_PER_TOKEN = 4
+EMBED_DIM = 768
+VOLATILE_RE = re.compile(r"[0-9a-f]{8}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{12}|\d+", re.I)
+
+
+class FakeLLM:
+    def __init__(self, latency_ms: float, token_rate: float, embed_latency_ms: float, body_items: int):
+        self.latency = latency_ms / 1000
+        self.token_rate = token_rate
+        self.embed_latency = embed_latency_ms / 1000
+        self.body_items = body_items
+        self.chats = 0
+        self.embedded = 0
+        self.started = time.time()
+
+    def answer(self, prompt: str) -> str:
+        match = re.search(r'"path":\s*"([^"]*)"|/([\w./-]+)', prompt)
+        path = next((g for g in match.groups() if g), "") if match else ""
+        return orjson.dumps({
+            "status_code": 200,
+            "headers": {"Content-Type": "application/json", "Server": "nginx/1.18.0"},
+            "body": {
+                "path": path,
+                "items": [{"id": i, "name": f"item-{i}", "active": i % 2 == 0} for i in range(self.body_items)],
+            },
+        }).decode()
+
+    async def tokens(self, text: str) -> AsyncIterator[str]:
+        await asyncio.sleep(self.latency)
+        delay = 1 / self.token_rate if self.token_rate > 0 else 0
+        for i in range(0, len(text), CHARS_PER_TOKEN):
+            if delay:
+                await asyncio.sleep(delay)
+            yield text[i:i + CHARS_PER_TOKEN]
+
+    async def complete(self, text: str) -> None:
+        async for _ in self.tokens(text):
+            pass
+
+    @staticmethod
+    def embedding(text: str) -> List[float]:
+        seed = hashlib.sha256(VOLATILE_RE.sub("#", text).encode()).digest()
+        rng = np.random.default_rng(int.from_bytes(seed[:8], "little"))
+        vec = rng.standard_normal(EMBED_DIM).astype(np.float32)
+        return (vec / np.linalg.norm(vec)).tolist()
+
+
+def user_prompt(payload: Dict[str, Any]) -> str:
+    return next((m["content"] for m in reversed(payload.get("messages", [])) if m.get("role") == "user"), "")
+
+
+def create_app(llm: FakeLLM) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/api/tags")
+    @app.get("/v1/models")
+    async def health():
+        return {"models": [], "data": []}
+
+    @app.get("/stats")
+    async def stats():
+        return {"chats": llm.chats, "embedded": llm.embedded, "uptime": time.time() - llm.started}
+
+    @app.post("/api/embed")
+    async def embed(request: Request):
+        payload = orjson.loads(await request.body())
+        texts = payload["input"] if isinstance(payload["input"], list) else [payload["input"]]
+        await asyncio.sleep(llm.embed_latency)
+        llm.embedded += len(texts)
+        return Response(orjson.dumps({"embeddings": [llm.embedding(t) for t in texts]}), media_type="application/json")
+
+    @app.post("/api/chat")
+    async def ollama_chat(request: Request):
+        payload = orjson.loads(await request.body())
+        llm.chats += 1
+        text = llm.answer(user_prompt(payload))
+
+        if not payload.get("stream"):
+            await llm.complete(text)
+            return {"message": {"role": "assistant", "content": text}, "done": True}
+
+        async def lines() -> AsyncIterator[bytes]:
+            async for token in llm.tokens(text):
+                yield orjson.dumps({"message": {"role": "assistant", "content": token}, "done": False}) + b"\n"
+            yield orjson.dumps({"message": {"role": "assistant", "content": ""}, "done": True}) + b"\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    @app.post("/v1/chat/completions")
+    async def openai_chat(request: Request):
+        payload = orjson.loads(await request.body())
+        llm.chats += 1
+        text = llm.answer(user_prompt(payload))
+
+        if not payload.get("stream"):
+            await llm.complete(text)
+            return {"choices": [{"index": 0, "message": {"role": "assistant", "content": text}}]}
+
+        async def events() -> AsyncIterator[bytes]:
+            async for token in llm.tokens(text):
+                yield b"data: " + orjson.dumps({"choices": [{"index": 0, "delta": {"content": token}}]}) + b"\n\n"
+            yield b"data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11555)
+    parser.add_argument("--latency", type=float, default=200, help="ms before the first token")
+    parser.add_argument("--token-rate", type=float, default=80, help="tokens per second, 0 for no delay")
+    parser.add_argument("--embed-latency", type=float, default=5, help="ms per /api/embed call")
+    parser.add_argument("--body-items", type=int, default=10, help="items in each generated body")
+    args = parser.parse_args()
+
+    llm = FakeLLM(args.latency, args.token_rate, args.embed_latency, args.body_items)
+    uvicorn.run(create_app(llm), host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
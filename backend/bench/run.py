@@ -0,0 +1,386 @@
+"""
+Benchmarks the request pipeline in-process against a temp SQLite database and a fake LLM.
+
+    cd backend
+    python -m bench.run                                   # every scenario
+    python -m bench.run -s hit,vector -n 5000 -c 100
+    python -m bench.run --json baseline.json              # save the results
+    python -m bench.run --baseline baseline.json          # exit 1 on a regression
+
+Requests go through the FastAPI app over httpx's ASGI transport, so routing, validation,
+ResourceService and InteractionService all run exactly as in production. The fake LLM
+(bench/fake_llm.py) runs in a separate process so it does not share the event loop.
+
+Needs Redis at REDIS_HOST:REDIS_PORT. Every run uses fresh paths and client IPs,
+so a Redis that is not empty does not change the results.
+Any app setting (LLM_CONCURRENCY, RATE_MISS_LIMIT, ...) can be overridden from the environment,
+except the database and body store, which always live in a temp directory, and metrics,
+which stay in-process so they can be reported per scenario and never reach a live /metrics.
+"""
+import argparse
+import asyncio
+import os
+import random
+import re
+import string
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+import orjson
+
+
+SCENARIOS = ("hit", "canonical", "vector", "cold_miss", "crud", "login", "fuzz")
+WORDLIST = Path(__file__).resolve().parent.parent / "locust" / "fuzzing.txt"
+STAGE_FIELD = re.compile(r'^honeypot_stage_seconds_(bucket|sum|count)\{stage="([^"]*)"(?:,le="([^"]*)")?\}$')
+
+Op = Callable[[int], Awaitable[int]]
+
+
+def configure(args: argparse.Namespace, workdir: str) -> None:
+    """
+    The app reads its settings at import time, so this runs before anything from app/ is imported.
+    """
+    fake = f"http://127.0.0.1:{args.llm_port}"
+    # never inherited, a DB_NAME exported for the honeypot would point the bench at live data
+    os.environ["DB_NAME"] = os.path.join(workdir, "bench.db")
+    os.environ["BODY_STORE_DIR"] = os.path.join(workdir, "bodies")
+    os.environ["METRICS_PORT"] = "0"
+    os.environ.setdefault("SECRET", "bench-" + "0" * 58)
+    os.environ.setdefault("TEMPLATE_RELOAD_INTERVAL", "0")
+    os.environ["OLLAMA_BASE_URLS"] = fake
+    os.environ["OLLAMA_EMBED_URLS"] = fake
+    os.environ["OPEN_API_URL"] = f"{fake}/v1"
+    if args.backend == "openai":
+        os.environ.setdefault("OPEN_API_KEY", "bench")
+        os.environ["LLM_CHAT_BACKENDS"] = "openai"
+    else:
+        os.environ["LLM_CHAT_BACKENDS"] = "ollama"
+
+
+def start_fake_llm(args: argparse.Namespace) -> subprocess.Popen:  # type: ignore
+    proc = subprocess.Popen([
+        sys.executable, "-m", "bench.fake_llm",
+        "--port", str(args.llm_port),
+        "--latency", str(args.llm_latency),
+        "--token-rate", str(args.token_rate),
+        "--embed-latency", str(args.embed_latency),
+    ], cwd=Path(__file__).resolve().parent.parent)
+    return proc
+
+
+async def wait_for(client: Any, url: str, timeout: float = 15) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            r = await client.get(url)
+            if r.status_code == 200:
+                return
+        except Exception:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"{url} did not come up")
+        await asyncio.sleep(0.1)
+
+
+def alpha(i: int) -> str:
+    """
+    Path segments have to be letters only (or UUIDs) to pass request validation.
+    """
+    out = ""
+    while True:
+        i, r = divmod(i, 26)
+        out = string.ascii_lowercase[r] + out
+        if i == 0:
+            return out
+
+
+def random_ip() -> str:
+    # a different /24 for every request keeps per-subnet limits out of the way
+    return f"10.{random.randint(0, 255)}.{random.randint(0, 255)}.{random.randint(1, 254)}"
+
+
+def histogram_quantile(q: float, buckets: List[Tuple[float, float]]) -> float:
+    """
+    Estimates a quantile from cumulative (le, count) buckets the way Prometheus does,
+    by interpolating linearly inside the bucket the quantile falls into.
+    """
+    total = buckets[-1][1]
+    if not total:
+        return 0.0
+    rank = q * total
+    lower, below = 0.0, 0.0
+    for le, count in buckets:
+        if count >= rank:
+            if le == float("inf"):
+                return lower
+            return lower + (le - lower) * ((rank - below) / (count - below) if count > below else 1)
+        lower, below = le, count
+    return lower
+
+
+def stage_breakdown(pending: Dict[str, float]) -> Dict[str, Dict[str, float]]:
+    """
+    Per-stage latency from the honeypot_stage_seconds histograms recorded during one scenario.
+    """
+    buckets: Dict[str, List[Tuple[float, float]]] = defaultdict(list)
+    sums: Dict[str, float] = {}
+    counts: Dict[str, float] = {}
+    for field, value in pending.items():
+        match = STAGE_FIELD.match(field)
+        if not match:
+            continue
+        kind, stage, le = match.groups()
+        if kind == "bucket":
+            buckets[stage].append((float("inf") if le == "+Inf" else float(le), value))
+        elif kind == "sum":
+            sums[stage] = value
+        else:
+            counts[stage] = value
+
+    stages = {}
+    for stage, count in sorted(counts.items()):
+        if not count:
+            continue
+        series = sorted(buckets[stage])
+        stages[stage] = {
+            "count": int(count),
+            "mean_ms": round(sums.get(stage, 0.0) / count * 1000, 3),
+            "p50_ms": round(histogram_quantile(0.5, series) * 1000, 3),
+            "p95_ms": round(histogram_quantile(0.95, series) * 1000, 3),
+        }
+    return stages
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+async def measure(name: str, op: Op, requests: int, concurrency: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    statuses: Counter = Counter()  # type: ignore
+    counter = iter(range(requests))
+
+    async def worker() -> None:
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                status = await op(i)
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            statuses[status] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "scenario": name,
+        "requests": requests,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "rps": round(requests / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "statuses": {str(k): v for k, v in sorted(statuses.items(), key=lambda kv: str(kv[0]))},
+    }
+
+
+async def build_scenario(name: str, client: Any, app: Any, tag: str, wordlist: List[str]) -> Op:
+    """
+    Warms whatever the scenario needs and returns the operation to time.
+    """
+    import jwt
+
+    from app.services.resources import ResourceService
+    from app.variables import SECRET
+
+    async def get(path: str, ip: str) -> int:
+        r = await client.get(f"/{path}", headers={"X-Forwarded-For": ip, "Accept-Encoding": "gzip, br"})
+        return r.status_code
+
+    if name == "hit":
+        path = f"{tag}/hit"
+        await get(path, random_ip())
+
+        async def op(i: int) -> int:
+            return await get(path, "192.0.2.1")
+        return op
+
+    if name == "canonical":
+        # live GETs find their resource by path first, so this times the canonical tier on its own
+        path = f"{tag}/canonical"
+        await get(f"{path}?b=2&a=1", random_ip())
+        service = ResourceService(app.state.db, app.state.redis)
+        canonical = f"GET:{path}?a=1&b=2"
+
+        async def op(i: int) -> int:
+            res = await service.find_resource(f"{tag}/absent", canonical)
+            return 200 if res else 404
+        return op
+
+    if name == "vector":
+        # the fake embedder ignores UUIDs, so every new id lands on the warmed resource
+        await get(f"{tag}/users/{uuid.uuid4()}", random_ip())
+
+        async def op(i: int) -> int:
+            return await get(f"{tag}/users/{uuid.uuid4()}", random_ip())
+        return op
+
+    if name == "cold_miss":
+        async def op(i: int) -> int:
+            return await get(f"{tag}/miss/{alpha(i)}", random_ip())
+        return op
+
+    if name == "crud":
+        path = f"{tag}/crud"
+        await get(path, random_ip())
+        token = jwt.encode({"sub": "bench", "exp": int(time.time()) + 3600}, SECRET, algorithm="HS512")  # type: ignore
+        headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+
+        async def op(i: int) -> int:
+            r = await client.post(f"/{path}", content=orjson.dumps({"path": f"updated-{i}"}), headers=headers | {"X-Forwarded-For": random_ip()})
+            return r.status_code
+        return op
+
+    if name == "login":
+        # one client guessing credentials as fast as it can
+        ip = random_ip()
+
+        async def op(i: int) -> int:
+            r = await client.post("/login", json={"username": f"{tag}-{i}", "password": "hunter2"}, headers={"X-Forwarded-For": ip})
+            return r.status_code
+        return op
+
+    if name == "fuzz":
+        # one scanner walking a wordlist: emulated files, rejected paths, misses and rate limits
+        ip = random_ip()
+
+        async def op(i: int) -> int:
+            return await get(wordlist[i % len(wordlist)], ip)
+        return op
+
+    raise ValueError(f"Unknown scenario {name}, expected one of {', '.join(SCENARIOS)}")
+
+
+def print_results(results: List[Dict[str, Any]]) -> None:
+    header = f"{'scenario':<10} {'requests':>8} {'conc':>5} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}  statuses"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        statuses = " ".join(f"{k}:{v}" for k, v in r["statuses"].items())
+        print(f"{r['scenario']:<10} {r['requests']:>8} {r['concurrency']:>5} {r['rps']:>9} "
+              f"{r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9}  {statuses}")
+
+    # bucket estimates, good to tell which stage moved, not for exact numbers
+    header = f"{'scenario':<10} {'stage':<18} {'count':>8} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9}"
+    print()
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        for stage, s in r.get("stages", {}).items():
+            print(f"{r['scenario']:<10} {stage:<18} {s['count']:>8} {s['mean_ms']:>9} {s['p50_ms']:>9} {s['p95_ms']:>9}")
+
+
+def regressions(results: List[Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    found = []
+    previous = {r["scenario"]: r for r in baseline["results"]}
+    for r in results:
+        before = previous.get(r["scenario"])
+        if not before:
+            continue
+        if r["rps"] < before["rps"] * (1 - tolerance / 100):
+            found.append(f"{r['scenario']}: rps {before['rps']} -> {r['rps']}")
+        if r["p95_ms"] > before["p95_ms"] * (1 + tolerance / 100):
+            found.append(f"{r['scenario']}: p95 {before['p95_ms']}ms -> {r['p95_ms']}ms")
+    return found
+
+
+async def run(args: argparse.Namespace) -> int:
+    import httpx
+
+    from main import app
+    from app.lifespan import startup, shutdown
+    from app.utils.metrics import metrics
+
+    fake_llm = start_fake_llm(args)
+    try:
+        async with httpx.AsyncClient() as probe:
+            await wait_for(probe, f"http://127.0.0.1:{args.llm_port}/api/tags")
+
+        await startup(app)
+        tag = "bench" + "".join(random.choices(string.ascii_lowercase, k=8))
+        wordlist = [line.strip().lstrip("/") for line in WORDLIST.read_text(errors="replace").splitlines() if line.strip()]
+        random.Random(args.seed).shuffle(wordlist)
+
+        transport = httpx.ASGITransport(app=app)  # type: ignore
+        results = []
+        async with httpx.AsyncClient(transport=transport, base_url="http://honeypot", timeout=None) as client:
+            for name in args.scenarios:
+                op = await build_scenario(name, client, app, tag, wordlist)
+                # stages timed while warming up belong to no scenario
+                metrics.take()
+                result = await measure(name, op, args.requests, args.concurrency)
+                result["stages"] = stage_breakdown(metrics.take())
+                results.append(result)
+                print(f"[bench] {name} done in {result['seconds']}s")
+
+        await shutdown(app)
+    finally:
+        fake_llm.terminate()
+        fake_llm.wait()
+
+    print_results(results)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "args": {k: v for k, v in vars(args).items() if k not in ("json", "baseline")},
+        "results": results,
+    }
+    if args.json:
+        Path(args.json).write_bytes(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+
+    if args.baseline:
+        found = regressions(results, orjson.loads(Path(args.baseline).read_bytes()), args.tolerance)
+        for line in found:
+            print(f"[bench] Regression {line}")
+        return 1 if found else 0
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-s", "--scenarios", default=",".join(SCENARIOS), help="comma separated")
+    parser.add_argument("-n", "--requests", type=int, default=1000, help="requests per scenario")
+    parser.add_argument("-c", "--concurrency", type=int, default=50)
+    parser.add_argument("--backend", choices=("ollama", "openai"), default="ollama")
+    parser.add_argument("--llm-port", type=int, default=11555)
+    parser.add_argument("--llm-latency", type=float, default=200, help="ms before the first token")
+    parser.add_argument("--token-rate", type=float, default=80, help="tokens per second")
+    parser.add_argument("--embed-latency", type=float, default=5, help="ms per embedding call")
+    parser.add_argument("--seed", type=int, default=0, help="wordlist order for the fuzz scenario")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="compare with a file written by --json")
+    parser.add_argument("--tolerance", type=float, default=20, help="allowed rps / p95 change in percent")
+    args = parser.parse_args()
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+
+    with tempfile.TemporaryDirectory(prefix="honeypot-bench-") as workdir:
+        configure(args, workdir)
+        sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,11 @@
 #!/bin/bash
-cd /workspace/backend && uvicorn main:app --host 0.0.0.0 --port 5000 --reload
\ No newline at end of file
+cd /workspace/backend
+
+# resolve the dated database once so every worker opens the same file
+export DB_NAME="${DB_NAME:-/volume/$(date +%Y-%m-%d).db}"
+
+if [ "$RUN_MODE" = "production" ]; then
+    exec uvicorn main:app --host 0.0.0.0 --port 5000 --workers "${WORKERS:-$(nproc)}" --no-access-log
+fi
+
+exec uvicorn main:app --host 0.0.0.0 --port 5000 --reload
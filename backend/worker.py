@@ -0,0 +1,42 @@
+from typing import Any, Dict
+
+from arq import cron
+
+from app.database import init_db
+from app.redis_db import redis_settings
+from app.services.prefetch import PrefetchService
+from app.utils.llm import init_http_clients, close_http_clients
+from app.utils.templates import template_registry
+from app.utils.metrics import metrics
+from app.utils.vector_index import init_vector_index, close_vector_index
+from app.variables import PREFETCH_INTERVAL_MINUTES
+
+
+async def startup(ctx: Dict[str, Any]) -> None:
+    ctx["db"] = await init_db(True)
+    init_http_clients()
+    await init_vector_index(ctx["db"])
+    template_registry.start()
+    await metrics.start(ctx["redis"])
+
+
+async def shutdown(ctx: Dict[str, Any]) -> None:
+    await metrics.stop()
+    await template_registry.stop()
+    await close_vector_index()
+    await close_http_clients()
+    await ctx["db"].close()
+
+
+async def prefetch(ctx: Dict[str, Any]) -> int:
+    return await PrefetchService(ctx["db"], ctx["redis"]).run()
+
+
+class WorkerSettings:
+    redis_settings = redis_settings()
+    on_startup = startup
+    on_shutdown = shutdown
+    functions = [prefetch]
+    cron_jobs = [
+        cron(prefetch, minute=set(range(0, 60, PREFETCH_INTERVAL_MINUTES)), run_at_startup=True, timeout=3600),
+    ]